@@ -1,87 +1,537 @@
 import discord
 from discord.ext import commands
-import google.generativeai as genai
 from google.api_core import exceptions
 import os
 import datetime
 import pytz
-import aiohttp  # 用來下載圖片
 import io
-from dotenv import load_dotenv
+import time
+import asyncio
+import hashlib
+import re
+import sqlite3
+from PIL import Image
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# 👇 這裡換成了你清單中最強、額度最穩的 Gemini 2.5 Flash
+MODEL_NAME = 'models/gemini-2.5-flash'
+SYSTEM_INSTRUCTION = "你是一個 Discord 助手。回答簡潔。如果 User 傳送圖片，請根據圖片內容回應。"
+
+MAX_CONVERSATIONS = 200 # 記憶體裡最多同時保留幾段對話 (LRU)
+IDLE_TIMEOUT = 1800 # 對話閒置超過 30 分鐘就丟掉
+TOKEN_BUDGET = int(os.getenv("GEMINI_HISTORY_TOKENS", 8000)) # 每段對話帶給 AI 的歷史上限
+IMAGE_TOKENS = 258 # Gemini 一張圖大約算 258 tokens
+# 🖼️ 圖片附件：只收這些格式，太大的不下載，送出前縮到最長邊 MAX_IMAGE_SIDE
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif", ".webp")
+MAX_IMAGES = 4 # 一則訊息最多處理幾張
+MAX_IMAGE_BYTES = 10 * 1024 * 1024
+MAX_IMAGE_SIDE = 1536
+IMAGE_CACHE_SIZE = 64 # 處理好的圖片留在記憶體裡幾張 (LRU)
+# 🧠 !chat 回應快取：同樣的問題 (+ 同樣的圖) 在時限內直接回答，設成 0 就關掉
+# 提示詞裡有系統時間 (讓 AI 能回答「現在幾點」)，快取的答案最多會舊 TTL 這麼久，所以時限只抓幾分鐘；
+# 日期有放進快取 key，「今天星期幾」這種不會跨過半夜還拿到昨天的答案
+RESPONSE_CACHE_TTL = int(os.getenv("AI_RESPONSE_CACHE_TTL", 300))
+RESPONSE_CACHE_SIZE = 256
+# 🧩 自動對話頻道：同一個人連續傳的幾則訊息，停頓超過 BURST_WINDOW 秒才合成一題一起問
+BURST_WINDOW = 2.0
+BURST_MAX_WAIT = 8.0 # 一直打字也最多等這麼久
+# 📦 對話紀錄存檔：重開機後回到同一個頻道還記得剛剛聊什麼
+DB_FILE = "ai_chat.db"
+RETENTION_DAYS = 30 # 超過 30 天沒動的對話紀錄啟動時清掉
+# 串流回覆：邊收邊編輯訊息，編輯間隔抓寬一點才不會撞到 Discord 的限流
+MESSAGE_LIMIT = 2000
+EDIT_INTERVAL = 1.2
+# 只有「``` + 可有可無的語言標籤」獨佔一行才算 code block 的開關；```pip install foo``` 這種單行的不算
+FENCE_LINE = re.compile(r"```([\w+#.-]{0,32})")
+
+def estimate_tokens(parts):
+    # 粗估就好：中日韓字大約 1 字 1 token，英數大約 4 字元 1 token
+    total = 0
+    for part in parts:
+        if isinstance(part, str):
+            wide = sum(1 for c in part if ord(c) > 0x2E80)
+            total += wide + (len(part) - wide) // 4 + 1
+        else:
+            total += IMAGE_TOKENS
+    return total
+
+def open_fence(text, fence=None):
+    # 回傳 text 結束時還沒關掉的 code block 開頭 (例如 ```python)，沒有就是 None
+    for line in text.split("\n"):
+        match = FENCE_LINE.fullmatch(line.strip())
+        if not match:
+            continue
+        if fence:
+            # 關閉的那行不能帶語言標籤，帶了就只是 code block 裡的內容
+            if not match.group(1):
+                fence = None
+        else:
+            fence = "```" + match.group(1) # 重開時只補語言標籤，不整行照抄
+    return fence
+
+def split_message(text, limit=MESSAGE_LIMIT):
+    """把長文切成多則 Discord 訊息：優先切在段落 / 換行 / 空白，切到 code block 中間會自動補上關閉與重開"""
+    chunks = []
+    fence = None
+    while text:
+        prefix = fence + "\n" if fence else ""
+        if len(prefix) + len(text) <= limit:
+            chunks.append(prefix + text)
+            break
+        room = max(limit - len(prefix) - 4, limit // 2) # 留位置給補上的 "\n```"
+        # 段落切點太前面 (會切出很短的一則) 就退而求其次找換行、空白
+        for sep, least in (("\n\n", room // 2), ("\n", room // 4), (" ", 1)):
+            cut = text.rfind(sep, 0, room)
+            if cut >= least:
+                piece, text = text[:cut], text[cut + len(sep):]
+                break
+        else:
+            piece, text = text[:room], text[room:]
+        chunk = prefix + piece
+        fence = open_fence(chunk)
+        if fence:
+            chunk += "\n```"
+        chunks.append(chunk)
+    return chunks
+
+def normalize_prompt(text):
+    # 大小寫、前後空白、連續空白都不影響快取命中
+    return " ".join(text.lower().split())
+
+# --- 🧩 一串連發的訊息 ---
+class Burst:
+    def __init__(self):
+        self.messages = []
+        self.started = time.monotonic()
+        self.timer = None
+
+# --- 🧠 有時限的 LRU 快取 ---
+class ResponseCache:
+    def __init__(self, ttl, size):
+        self.ttl = ttl
+        self.size = size
+        self.entries = OrderedDict() # key -> (過期時間, 回答)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry and entry[0] > time.monotonic():
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        if entry:
+            del self.entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, key, value):
+        if self.ttl <= 0:
+            return
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+def is_image(attachment):
+    # 看副檔名跟 Discord 給的 content_type，不再用「檔名裡有 png」這種子字串比對
+    extension = os.path.splitext(attachment.filename.lower())[1]
+    content_type = (attachment.content_type or "").split(";")[0]
+    return extension in IMAGE_EXTENSIONS or content_type.startswith("image/")
+
+def shrink_image(data):
+    """縮圖 + 重新壓縮成 JPEG (在執行緒裡跑，Pillow 會吃 CPU)；打不開的圖回傳 None"""
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image.seek(0) # GIF 只取第一格
+            image.thumbnail((MAX_IMAGE_SIDE, MAX_IMAGE_SIDE))
+            if image.mode in ("RGBA", "LA", "P"):
+                # 透明背景鋪白底，不然轉 JPEG 會變黑
+                image = image.convert("RGBA")
+                background = Image.new("RGB", image.size, (255, 255, 255))
+                background.paste(image, mask=image.getchannel("A"))
+                image = background
+            elif image.mode != "RGB":
+                image = image.convert("RGB")
+            output = io.BytesIO()
+            image.save(output, format="JPEG", quality=85, optimize=True)
+    except Exception as e:
+        print(f"⚠️ 圖片無法處理: {e}")
+        return None
+    return output.getvalue()
+
+# --- ✍️ 串流回覆：收到一點就先顯示一點，超過 2000 字自動接著發下一則 ---
+class StreamingReply:
+    def __init__(self, send_first, channel):
+        self.send_first = send_first # 第一則用什麼送 (reply 或 ctx.send)
+        self.channel = channel # 後面接續的訊息直接發在頻道
+        self.messages = [] # [(Message, 目前內容)]
+        self.text = ""
+        self.last_flush = 0
+
+    async def update(self, text):
+        self.text = text
+        # 節流：距離上次編輯太近就先累積，等下一段文字進來再一起更新
+        if time.monotonic() - self.last_flush >= EDIT_INTERVAL:
+            await self.flush()
+
+    async def finish(self, text):
+        self.text = text
+        await self.flush()
+
+    async def flush(self):
+        self.last_flush = time.monotonic()
+        chunks = split_message(self.text)
+        for i, chunk in enumerate(chunks):
+            if i < len(self.messages):
+                message, content = self.messages[i]
+                if content != chunk: # 內容一樣就不浪費一次編輯
+                    await message.edit(content=chunk)
+                    self.messages[i] = (message, chunk)
+            else:
+                send = self.send_first if i == 0 else self.channel.send
+                self.messages.append((await send(chunk), chunk))
+        # 最後的文字比較短 (例如中途出錯換成錯誤訊息) 時，多出來的訊息刪掉
+        for message, _ in self.messages[len(chunks):]:
+            await message.delete()
+        del self.messages[len(chunks):]
+
+# --- 💾 對話資料庫：SQLite 全部丟到專屬執行緒，不卡住 event loop ---
+class ChatDB:
+    def __init__(self, path):
+        self.path = path
+        self.conn = None
+        # 只開一條執行緒：所有讀寫照順序排隊，SQLite 連線也只在這條線上使用
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chat-db")
+
+    async def run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    async def open(self):
+        await self.run(self._open)
+
+    async def close(self):
+        await self.run(self._close)
+        self.executor.shutdown(wait=True)
+
+    def _open(self):
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA foreign_keys=ON") # 刪 turns 時 turn_images 跟著刪
+        # turns：每一句對話；turn_images：那句附了哪些圖片 (只記 hash，原檔不存，歷史裡也只留標記)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS turns (
+                turn_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                conv_key TEXT NOT NULL,
+                role TEXT NOT NULL,
+                text TEXT NOT NULL,
+                tokens INTEGER NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_turns_conv ON turns (conv_key, turn_id);
+
+            CREATE TABLE IF NOT EXISTS turn_images (
+                turn_id INTEGER NOT NULL REFERENCES turns (turn_id) ON DELETE CASCADE,
+                hash TEXT NOT NULL,
+                PRIMARY KEY (turn_id, hash)
+            ) WITHOUT ROWID;
+        """)
+        # 清掉太舊的對話
+        with self.conn:
+            self.conn.execute("DELETE FROM turns WHERE created_at < ?", (time.time() - RETENTION_DAYS * 86400,))
+
+    def _close(self):
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+
+    def _load_turns(self, conv_key, budget):
+        # 從最新的往回讀，讀到預算滿為止；開頭一定要是 user 那句
+        turns = []
+        total = 0
+        for row in self.conn.execute("""
+            SELECT turn_id, role, text, tokens FROM turns
+            WHERE conv_key = ? ORDER BY turn_id DESC
+        """, (conv_key,)):
+            if total + row[3] > budget:
+                break
+            turns.append(row)
+            total += row[3]
+        turns.reverse()
+        while turns and turns[0][1] != "user":
+            turns.pop(0)
+        return turns
+
+    def _save_turns(self, conv_key, turns, dropped):
+        # 新的一問一答跟被修剪掉的舊紀錄，全部同一個 transaction
+        now = time.time()
+        with self.conn:
+            turn_ids = []
+            for role, text, image_hashes, tokens in turns:
+                turn_id = self.conn.execute("""
+                    INSERT INTO turns (conv_key, role, text, tokens, created_at)
+                    VALUES (?, ?, ?, ?, ?)
+                """, (conv_key, role, text, tokens, now)).lastrowid
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO turn_images (turn_id, hash) VALUES (?, ?)",
+                    [(turn_id, h) for h in image_hashes]
+                )
+                turn_ids.append(turn_id)
+            dropped_ids = [turn_id for turn_id in dropped if turn_id is not None]
+            if dropped_ids:
+                self.conn.execute(
+                    "DELETE FROM turns WHERE conv_key = ? AND turn_id <= ?", (conv_key, max(dropped_ids))
+                )
+        return turn_ids
+
+    async def load_turns(self, conv_key, budget):
+        return await self.run(self._load_turns, conv_key, budget)
+
+    async def save_turns(self, conv_key, turns, dropped):
+        return await self.run(self._save_turns, conv_key, turns, dropped)
+
+# --- 💬 單一對話 (一個頻道 / 討論串 / 私訊對象一份) ---
+# 記憶體裡只放「最近有在聊」的對話，其他的等有人開口才從資料庫讀回來
+class Conversation:
+    def __init__(self):
+        self.turns = [] # [{"role": "user"/"model", "parts": [...], "turn_id": ...}]
+        self.tokens = 0
+        self.loaded = False
+        self.last_used = time.monotonic()
+        self.lock = asyncio.Lock() # 同一段對話一次只問一題，歷史順序才不會亂
+
+    def restore(self, rows):
+        for turn_id, role, text, tokens in rows:
+            self.turns.append({"role": role, "parts": [text], "tokens": tokens, "turn_id": turn_id})
+            self.tokens += tokens
+        self.loaded = True
+
+    def append(self, role, parts):
+        tokens = estimate_tokens(parts)
+        turn = {"role": role, "parts": parts, "tokens": tokens, "turn_id": None}
+        self.turns.append(turn)
+        self.tokens += tokens
+        return turn
+
+    def trim(self, budget):
+        # 從最舊的一問一答開始丟，直到塞得進預算 (至少留下最後一組)；回傳被丟掉的紀錄
+        dropped = []
+        while self.tokens > budget and len(self.turns) > 2:
+            for turn in self.turns[:2]:
+                self.tokens -= turn["tokens"]
+                dropped.append(turn["turn_id"])
+            del self.turns[:2]
+        return dropped
+
+    def history(self):
+        return [{"role": turn["role"], "parts": turn["parts"]} for turn in self.turns]
 
 class AIChat(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        load_dotenv(override=True)
-        self.api_key = os.getenv("GEMINI_API_KEY")
-        self.model = None 
-        self.chat_session = None
+        self.model = None # 第一次用到 (或連上 Discord 後在背景) 才跟 Gemini 模組拿
+        self.conversations = OrderedDict() # key -> Conversation，越後面越常用
+        self.db = ChatDB(DB_FILE)
+        # 處理好的圖片：附件 id 跟原檔 hash 都指到同一份結果，同一張圖不用再下載、再縮一次
+        self.image_cache = OrderedDict()
+        self.response_cache = ResponseCache(RESPONSE_CACHE_TTL, RESPONSE_CACHE_SIZE)
+        self.bursts = {} # (頻道 id, 作者 id) -> 還在收集中的 Burst
+        self.burst_tasks = set() # 還在倒數或回答中的 answer_burst，卸載時要一起收掉
         self.auto_chat_channel_id = 1463744730243399842
 
-        if self.api_key:
-            genai.configure(api_key=self.api_key)
-            
-            # 👇 這裡換成了你清單中最強、額度最穩的 Gemini 2.5 Flash
-            target_model = 'models/gemini-2.5-flash'
-            
-            print(f"🚀 正在初始化模型: {target_model}")
-            
-            try:
-                self.model = genai.GenerativeModel(
-                    model_name=target_model,
-                    system_instruction="你是一個 Discord 助手。回答簡潔。如果 User 傳送圖片，請根據圖片內容回應。"
-                )
-                self.chat_session = self.model.start_chat(history=[])
-                print(f"✅ Gemini 初始化成功！使用模型: {target_model}")
-            except Exception as e:
-                print(f"❌ 初始化失敗: {e}")
-        else:
-            print("⚠️ 嚴重錯誤：找不到 API Key")
+
+    async def cog_load(self):
+        await self.db.open()
+
+    async def cog_unload(self):
+        # 先讓還在跑的回答停下來，它們最後會寫資料庫
+        tasks = list(self.burst_tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.db.close()
+
+    async def load_model(self):
+        # 模型由 Gemini 模組統一建立、共用；API Key 有問題也只影響 AI 功能
+        try:
+            self.model = await self.bot.get_cog("Gemini").get_model(MODEL_NAME, SYSTEM_INSTRUCTION)
+            print(f"✅ Gemini 初始化成功！使用模型: {MODEL_NAME}")
+        except Exception as e:
+            print(f"❌ 初始化失敗: {e}")
+        return self.model
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        # 連上 Discord 之後才在背景暖機，不拖慢啟動
+        if not self.model:
+            await self.load_model()
 
     def get_taiwan_time(self):
         tz = pytz.timezone('Asia/Taipei')
         now = datetime.datetime.now(tz)
         return now.strftime("%Y-%m-%d %H:%M")
 
-    # 👇 新增：圖片下載處理功能
-    async def process_attachments(self, message):
+    def conversation_key(self, message):
+        # 私訊以使用者為單位，伺服器裡以頻道 / 討論串為單位 (討論串本身就有自己的 id)
+        if message.guild is None:
+            return f"dm:{message.author.id}"
+        return f"channel:{message.channel.id}"
+
+    def get_conversation(self, key):
+        now = time.monotonic()
+        # 順手清掉閒置太久的對話 (最舊的都在前面，遇到還新的就可以停)
+        while self.conversations:
+            oldest_key, oldest = next(iter(self.conversations.items()))
+            if now - oldest.last_used < IDLE_TIMEOUT or oldest.lock.locked():
+                break
+            del self.conversations[oldest_key]
+
+        conversation = self.conversations.get(key)
+        if conversation is None:
+            conversation = self.conversations[key] = Conversation()
+            # 超過上限就從最久沒用的開始踢；正在回覆的不能踢，不然同一段對話會變成兩份
+            excess = len(self.conversations) - MAX_CONVERSATIONS
+            if excess > 0:
+                victims = [
+                    old_key for old_key, old in self.conversations.items()
+                    if old_key != key and not old.lock.locked()
+                ][:excess]
+                for old_key in victims:
+                    del self.conversations[old_key]
+        self.conversations.move_to_end(key)
+        conversation.last_used = now
+        return conversation
+
+    def cache_image(self, key, part):
+        self.image_cache[key] = part
+        self.image_cache.move_to_end(key)
+        while len(self.image_cache) > IMAGE_CACHE_SIZE * 2: # 每張圖佔兩個 key
+            self.image_cache.popitem(last=False)
+
+    async def load_image(self, attachment):
+        part = self.image_cache.get(attachment.id)
+        if part:
+            self.image_cache.move_to_end(attachment.id)
+            return part
+
+        http = self.bot.get_cog("HttpClient")
+        resp = await http.request("GET", attachment.url, max_bytes=MAX_IMAGE_BYTES)
+        if resp.status != 200:
+            return None
+        digest = hashlib.sha256(resp.body).hexdigest()
+        part = self.image_cache.get(digest)
+        if part is None:
+            data = await asyncio.to_thread(shrink_image, resp.body)
+            if data is None:
+                return None
+            # 轉換成 Gemini 看得懂的格式
+            part = {"mime_type": "image/jpeg", "data": data}
+            self.cache_image(digest, part)
+        self.cache_image(attachment.id, part)
+        return part
+
+    # 👇 圖片處理：挑出圖片附件，同時下載 + 縮圖
+    async def process_attachments(self, attachments):
+        attachments = [
+            attachment for attachment in attachments
+            if is_image(attachment) and attachment.size <= MAX_IMAGE_BYTES
+        ][:MAX_IMAGES]
+        results = await asyncio.gather(*(self.load_image(a) for a in attachments), return_exceptions=True)
         image_parts = []
-        if message.attachments:
-            async with aiohttp.ClientSession() as session:
-                for attachment in message.attachments:
-                    # 檢查是否為圖片或 GIF
-                    if any(ext in attachment.filename.lower() for ext in ['png', 'jpg', 'jpeg', 'gif', 'webp']):
-                        async with session.get(attachment.url) as resp:
-                            if resp.status == 200:
-                                data = await resp.read()
-                                # 轉換成 Gemini 看得懂的格式
-                                image_parts.append({
-                                    "mime_type": attachment.content_type or "image/jpeg",
-                                    "data": data
-                                })
+        for attachment, result in zip(attachments, results):
+            if isinstance(result, Exception):
+                print(f"⚠️ 附件 {attachment.filename} 下載失敗: {result}")
+            elif result:
+                image_parts.append(result)
         return image_parts
 
-    async def get_ai_response(self, message, user_text):
-        if not self.model or not self.chat_session:
+    async def generate(self, contents, user_id, stream=None):
+        async def run():
+            # 被 429 重排時會整個重跑，所以回答要從頭累積
+            response = await self.model.generate_content_async(contents, stream=True)
+            text = ""
+            async for chunk in response:
+                try:
+                    text += chunk.text
+                except ValueError:
+                    continue # 沒有文字的片段 (例如被安全機制擋下)
+                if stream:
+                    await stream.update(text)
+            return text
+
+        async def on_queued(ahead):
+            if stream:
+                await stream.update(f"⏳ 排隊中，前面還有 {ahead} 個請求...")
+
+        # 交給 Gemini 排程器：限速、輪流、429 自動重試
+        gemini = self.bot.get_cog("Gemini")
+        return await gemini.submit(user_id, run, on_queued)
+
+    async def get_ai_response(self, message, user_text, stream=None, stateless=False, attachments=None):
+        """問 AI 並回傳完整回答；有給 stream (StreamingReply) 的話，回答會邊產生邊更新上去
+        stateless=True 是不帶歷史的單次提問，答案會進快取，同樣的問題直接回
+        attachments 沒給就用 message 自己的附件"""
+        if not self.model and not await self.load_model():
             return "❌ AI 尚未就緒"
         
         try:
             current_time = self.get_taiwan_time()
             
             # 1. 處理圖片 (如果有)
-            image_parts = await self.process_attachments(message)
+            if attachments is None:
+                attachments = message.attachments
+            image_parts = await self.process_attachments(attachments)
+            image_hashes = [hashlib.sha256(part["data"]).hexdigest() for part in image_parts]
             
             # 2. 組合提示詞
-            prompt_content = [f"(系統時間: {current_time}) User 說: {user_text}"]
+            prompt_text = f"(系統時間: {current_time}) User 說: {user_text}"
+            prompt_content = [prompt_text]
             
             # 3. 如果有圖片，加進去傳送內容
             if image_parts:
                 prompt_content.extend(image_parts)
                 print(f"📸 偵測到 {len(image_parts)} 張圖片，正在傳送給 AI...")
 
-            # 4. 發送請求
-            response = await self.chat_session.send_message_async(prompt_content)
-            return response.text
+            # 4a. 單次提問：先查快取，沒有才問 AI
+            if stateless:
+                cache_key = (normalize_prompt(user_text), ",".join(image_hashes), current_time[:10])
+                reply = self.response_cache.get(cache_key)
+                if reply is None:
+                    reply = await self.generate([{"role": "user", "parts": prompt_content}], message.author.id, stream)
+                    if not reply:
+                        return "⚠️ AI 沒有回任何內容，換個說法試試看？"
+                    self.response_cache.put(cache_key, reply)
+                return reply
+
+            # 4b. 帶著這段對話自己的歷史發送請求 (不在記憶體裡就先從資料庫讀回來)
+            key = self.conversation_key(message)
+            conversation = self.get_conversation(key)
+            async with conversation.lock:
+                if not conversation.loaded:
+                    conversation.restore(await self.db.load_turns(key, TOKEN_BUDGET))
+                dropped = conversation.trim(TOKEN_BUDGET - estimate_tokens(prompt_content))
+                history = conversation.history() + [{"role": "user", "parts": prompt_content}]
+                reply = await self.generate(history, message.author.id, stream)
+                if not reply:
+                    return "⚠️ AI 沒有回任何內容，換個說法試試看？"
+
+                # 歷史裡不留圖片原檔，只留一個標記，之後每次請求才不會一直重送；資料庫也只記 hash
+                if image_parts:
+                    prompt_text += f" [附上 {len(image_parts)} 張圖片]"
+                user_turn = conversation.append("user", [prompt_text])
+                model_turn = conversation.append("model", [reply])
+                new_turns = [user_turn, model_turn]
+                dropped += conversation.trim(TOKEN_BUDGET)
+                turn_ids = await self.db.save_turns(key, [
+                    ("user", prompt_text, image_hashes, user_turn["tokens"]),
+                    ("model", reply, [], model_turn["tokens"])
+                ], dropped)
+                for turn, turn_id in zip(new_turns, turn_ids):
+                    turn["turn_id"] = turn_id
+            return reply
 
         except exceptions.ResourceExhausted:
             return "💀 額度用完了 (429)，請稍等一下。"
@@ -98,12 +548,21 @@ class AIChat(commands.Cog):
             return
             
         async with ctx.typing():
-            # 傳入 ctx.message 以便抓取附件
-            response = await self.get_ai_response(ctx.message, user_msg)
-            if len(response) > 2000:
-                await ctx.send(response[:2000])
-            else:
-                await ctx.send(response)
+            # 傳入 ctx.message 以便抓取附件；!chat 是不帶歷史的單次提問，可以吃快取
+            stream = StreamingReply(ctx.send, ctx.channel)
+            response = await self.get_ai_response(ctx.message, user_msg, stream, stateless=True)
+            await stream.finish(response)
+
+    @commands.command()
+    async def ai_stats(self, ctx):
+        """查看 !chat 回應快取的命中率"""
+        cache = self.response_cache
+        total = cache.hits + cache.misses
+        ratio = cache.hits / total * 100 if total else 0
+        await ctx.send(
+            f"🧠 回應快取：命中 {cache.hits} / 未命中 {cache.misses} (命中率 {ratio:.1f}%)，"
+            f"目前存了 {len(cache.entries)} 筆"
+        )
 
     @commands.Cog.listener()
     async def on_message(self, message):
@@ -114,12 +573,53 @@ class AIChat(commands.Cog):
         is_mentioned = self.bot.user.mentioned_in(message)
 
         if (is_auto_channel or is_mentioned) and (message.content.strip() or message.attachments):
+            if is_auto_channel:
+                # 先收集起來，等這個人停下來再一次回答
+                self.collect_burst(message)
+                return
+
             # 如果是 Mention，去掉 @機器人 的字串
             clean_text = message.content.replace(f'<@{self.bot.user.id}>', '').strip()
             
             async with message.channel.typing():
-                response = await self.get_ai_response(message, clean_text)
-                await message.reply(response)
+                stream = StreamingReply(message.reply, message.channel)
+                response = await self.get_ai_response(message, clean_text, stream)
+                await stream.finish(response)
+
+    def collect_burst(self, message):
+        key = (message.channel.id, message.author.id)
+        burst = self.bursts.get(key)
+        if burst is None:
+            burst = self.bursts[key] = Burst()
+        burst.messages.append(message)
+        # 每來一則就重新倒數
+        if burst.timer:
+            burst.timer.cancel()
+        burst.timer = asyncio.create_task(self.answer_burst(key, burst))
+        self.burst_tasks.add(burst.timer)
+        burst.timer.add_done_callback(self.burst_tasks.discard)
+
+    async def answer_burst(self, key, burst):
+        wait = min(BURST_WINDOW, burst.started + BURST_MAX_WAIT - time.monotonic())
+        await asyncio.sleep(max(wait, 0))
+        # 從這裡開始就不能再被取消了：之後的新訊息會開一串新的
+        del self.bursts[key]
+
+        last = burst.messages[-1]
+        mention = f'<@{self.bot.user.id}>'
+        texts = [m.content.replace(mention, '').strip() for m in burst.messages]
+        clean_text = "\n".join(text for text in texts if text)
+        attachments = [a for m in burst.messages for a in m.attachments]
+
+        try:
+            async with last.channel.typing():
+                # 回覆最後一則，整串只問一次、回一次
+                stream = StreamingReply(last.reply, last.channel)
+                response = await self.get_ai_response(last, clean_text, stream, attachments=attachments)
+                await stream.finish(response)
+        except Exception as e:
+            # 背景 task 沒人接例外，訊息被刪、沒權限之類的要自己記下來
+            print(f"❌ [AI] 回覆連發訊息失敗: {e}")
 
 async def setup(bot):
     await bot.add_cog(AIChat(bot))
\ No newline at end of file
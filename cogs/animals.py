@@ -1,6 +1,5 @@
 import discord
 from discord.ext import commands
-import requests
 
 class Animals(commands.Cog):
     def __init__(self, bot):
@@ -10,9 +9,8 @@ class Animals(commands.Cog):
     async def cat(self, ctx):
         """隨機吸貓指令"""
         try:
-            # 這是免費的 API，不用申請 Key
-            response = requests.get("https://api.thecatapi.com/v1/images/search")
-            data = response.json()
+            # 這是免費的 API，不用申請 Key (透過共用連線池，不會卡住機器人)
+            data = await self.bot.get_cog("HttpClient").get_json("https://api.thecatapi.com/v1/images/search")
             image_url = data[0]['url'] # 抓圖片網址
 
             embed = discord.Embed(title="", color=0xff9900)
@@ -25,8 +23,7 @@ class Animals(commands.Cog):
     async def dog(self, ctx):
         """隨機吸狗指令"""
         try:
-            response = requests.get("https://dog.ceo/api/breeds/image/random")
-            data = response.json()
+            data = await self.bot.get_cog("HttpClient").get_json("https://dog.ceo/api/breeds/image/random")
             image_url = data['message']
 
             embed = discord.Embed(title="", color=0x0099ff)
@@ -3,6 +3,7 @@ from discord.ext import commands, tasks
 import feedparser
 import urllib.parse
 import datetime
+import asyncio
 import time # 👈 新增這個，用來處理時間格式
 
 class AutoNews(commands.Cog):
@@ -16,14 +17,21 @@ class AutoNews(commands.Cog):
         self.daily_news_task.cancel()
 
     # --- 抓新聞小幫手 (升級版) ---
-    def get_rss_news(self, keyword=None):
+    async def get_rss_news(self, keyword=None):
         if keyword:
             encoded_keyword = urllib.parse.quote(keyword)
             rss_url = f"https://news.google.com/rss/search?q={encoded_keyword}&hl=zh-TW&gl=TW&ceid=TW:zh-Hant"
         else:
             rss_url = "https://news.google.com/rss?hl=zh-TW&gl=TW&ceid=TW:zh-Hant"
 
-        feed = feedparser.parse(rss_url)
+        # 透過共用連線池下載，XML 解析丟到背景執行緒，不卡住機器人
+        try:
+            response = await self.bot.get_cog("HttpClient").request("GET", rss_url)
+            feed = await asyncio.to_thread(feedparser.parse, response.body)
+        except Exception as e:
+            print(f"❌ 抓取新聞失敗: {e}")
+            return []
+
         articles = []
         for entry in feed.entries[:8]: # 取前 8 則
             # 處理時間：把怪怪的文字時間轉成電腦看得懂的 Timestamp
@@ -92,7 +100,7 @@ class AutoNews(commands.Cog):
         search_title = f"🔍 搜尋：{keyword}" if keyword else "📰 最新頭條新聞"
         await ctx.send(f"正在抓取 {search_title} ...")
         
-        articles = self.get_rss_news(keyword)
+        articles = await self.get_rss_news(keyword)
         
         if not articles:
             await ctx.send("❌ 找不到相關新聞。")
@@ -118,7 +126,7 @@ class AutoNews(commands.Cog):
         elif 11 <= now.hour < 14: greeting = "🍱 午安！"
         else: greeting = "🌆 晚上好！"
 
-        articles = self.get_rss_news()
+        articles = await self.get_rss_news()
         if articles:
             embed = self.create_news_embed(articles, f"{greeting} 每日重點新聞")
             await channel.send(embed=embed)
@@ -1,53 +1,311 @@
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 import sqlite3
 import random
+import asyncio
+import bisect
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-class Economy(commands.Cog):
-    def __init__(self, bot):
-        self.bot = bot
+# ⏱️ 批次寫回設定：每 2 秒，或累積 200 筆異動就寫回一次 (一次 transaction)
+FLUSH_INTERVAL = 2.0
+FLUSH_THRESHOLD = 200
+
+# 🏆 排行榜每頁顯示人數
+LEADERBOARD_PAGE_SIZE = 10
+
+# 📸 每 6 小時拍一次餘額快照；保留最近 4 份，比最舊快照還舊的流水帳就清掉
+SNAPSHOT_HOURS = 6
+SNAPSHOT_KEEP = 4
+
+# --- 💾 帳本引擎：SQLite 全部丟到專屬執行緒，不卡住 event loop ---
+class Ledger:
+    def __init__(self, path):
+        self.path = path
+        self.conn = None
+        # 只開一條執行緒：所有讀寫都在同一條線上排隊，SQLite 連線也只在這條線上使用
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ledger")
+
+    async def run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    async def open(self):
+        await self.run(self._open)
+
+    async def close(self):
+        await self.run(self._close)
+        self.executor.shutdown(wait=True)
+
+    def _open(self):
         # 1.連結資料庫 (會自動在主目錄產生 economy.db 檔案)
-        self.conn = sqlite3.connect("economy.db")
-        self.cursor = self.conn.cursor()
-        
+        self.conn = sqlite3.connect(self.path)
+        # WAL：寫入改成追加日誌，讀取不會被寫入擋住；NORMAL 在 WAL 下仍然安全，且少很多次 fsync
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+
         # 2.如果表格不存在，就建立一個 (欄位：使用者ID, 錢)
-        self.cursor.execute("""
+        self.conn.execute("""
             CREATE TABLE IF NOT EXISTS users (
                 user_id INTEGER PRIMARY KEY,
                 money INTEGER DEFAULT 0
             )
         """)
+        # 排行榜用：依金額排序的索引 (user_id 是 rowid，所以這個索引本身就涵蓋查詢)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_users_money ON users (money)")
+
+        # 3.流水帳 (只追加不修改) + 餘額快照；AUTOINCREMENT 確保清掉舊紀錄後編號也不會重複
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS transactions (
+                txn_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                delta INTEGER NOT NULL,
+                reason TEXT,
+                created_at INTEGER NOT NULL
+            )
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS snapshots (
+                snapshot_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                last_txn_id INTEGER NOT NULL,
+                created_at INTEGER NOT NULL
+            )
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS snapshot_balances (
+                snapshot_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                money INTEGER NOT NULL,
+                PRIMARY KEY (snapshot_id, user_id)
+            ) WITHOUT ROWID
+        """)
         self.conn.commit()
 
-    # --- 小工具：確認使用者有沒有在資料庫裡 ---
-    def check_user(self, user_id):
-        self.cursor.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
-        if self.cursor.fetchone() is None:
-            # 如果沒資料，就新增一筆，預設 0 元
-            self.cursor.execute("INSERT INTO users (user_id, money) VALUES (?, 0)", (user_id,))
-            self.conn.commit()
+        # 第一次啟用流水帳：先幫現有餘額拍一張基準快照，重建時才有起點
+        if self.conn.execute("SELECT 1 FROM snapshots LIMIT 1").fetchone() is None:
+            self._snapshot()
 
-    # --- 小工具：讀取餘額 ---
-    def get_balance(self, user_id):
-        self.check_user(user_id)
-        self.cursor.execute("SELECT money FROM users WHERE user_id = ?", (user_id,))
-        return self.cursor.fetchone()[0]
-
-    # --- 小工具：修改餘額 (可以是正數或負數) ---
-    def update_balance(self, user_id, amount):
-        self.check_user(user_id)
-        current = self.get_balance(user_id)
+    def _close(self):
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+
+    def _get_balance(self, user_id):
+        row = self.conn.execute("SELECT money FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row else 0
+
+    def _load_ranking(self):
+        return self.conn.execute("SELECT user_id, money FROM users ORDER BY money DESC").fetchall()
+
+    def _write_batch(self, rows, entries):
+        # 流水帳追加 + 整批覆寫最新餘額，同一個 transaction、只 commit 一次
+        with self.conn:
+            self.conn.executemany("INSERT INTO transactions (user_id, delta, reason, created_at) VALUES (?, ?, ?, ?)", entries)
+            self.conn.executemany("""
+                INSERT INTO users (user_id, money) VALUES (?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET money = excluded.money
+            """, rows)
+
+    def _last_txn_id(self):
+        row = self.conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'transactions'").fetchone()
+        return row[0] if row else 0
+
+    def _snapshot(self):
+        # users 和流水帳永遠一起寫入，所以「目前的 users」剛好等於「所有 <= last_txn_id 的流水帳」的結果
+        with self.conn:
+            last_txn_id = self._last_txn_id()
+            latest = self.conn.execute("SELECT last_txn_id FROM snapshots ORDER BY snapshot_id DESC LIMIT 1").fetchone()
+            if latest and latest[0] == last_txn_id:
+                return False # 上次快照後沒有新交易
+
+            cur = self.conn.execute("INSERT INTO snapshots (last_txn_id, created_at) VALUES (?, ?)", (last_txn_id, int(time.time())))
+            self.conn.execute("INSERT INTO snapshot_balances SELECT ?, user_id, money FROM users", (cur.lastrowid,))
+        return True
+
+    def _compact(self):
+        # 只留最近 SNAPSHOT_KEEP 份快照，被最舊快照涵蓋的流水帳一起清掉
+        with self.conn:
+            kept = self.conn.execute("SELECT snapshot_id, last_txn_id FROM snapshots ORDER BY snapshot_id DESC LIMIT ?", (SNAPSHOT_KEEP,)).fetchall()
+            oldest_id, oldest_txn = kept[-1]
+            self.conn.execute("DELETE FROM snapshot_balances WHERE snapshot_id < ?", (oldest_id,))
+            self.conn.execute("DELETE FROM snapshots WHERE snapshot_id < ?", (oldest_id,))
+            return self.conn.execute("DELETE FROM transactions WHERE txn_id <= ?", (oldest_txn,)).rowcount
+
+    def _replay(self):
+        # 從最新快照 + 之後的流水帳重建 users
+        with self.conn:
+            snapshot_id, last_txn_id = self.conn.execute("SELECT snapshot_id, last_txn_id FROM snapshots ORDER BY snapshot_id DESC LIMIT 1").fetchone()
+            self.conn.execute("DELETE FROM users")
+            self.conn.execute("INSERT INTO users (user_id, money) SELECT user_id, money FROM snapshot_balances WHERE snapshot_id = ?", (snapshot_id,))
+            self.conn.execute("""
+                INSERT INTO users (user_id, money)
+                SELECT user_id, SUM(delta) FROM transactions WHERE txn_id > ? GROUP BY user_id
+                ON CONFLICT(user_id) DO UPDATE SET money = money + excluded.money
+            """, (last_txn_id,))
+            return self.conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    async def get_balance(self, user_id):
+        return await self.run(self._get_balance, user_id)
+
+    async def write_batch(self, rows, entries):
+        await self.run(self._write_batch, rows, entries)
+
+    async def load_ranking(self):
+        return await self.run(self._load_ranking)
+
+    async def snapshot(self):
+        if await self.run(self._snapshot):
+            return await self.run(self._compact)
+        return 0
+
+    async def replay(self):
+        return await self.run(self._replay)
+
+# --- 🏆 排行榜：開機時照索引順序載入一次，之後每次餘額變動就地更新 ---
+class Leaderboard:
+    def __init__(self):
+        self.scores = {} # user_id -> 金額
+        self.order = [] # 排序好的 (-金額, user_id)，二分搜尋就能查名次
+
+    def __len__(self):
+        return len(self.order)
+
+    def load(self, rows):
+        self.scores = dict(rows)
+        self.order = sorted((-money, user_id) for user_id, money in rows)
+
+    def update(self, user_id, money):
+        old = self.scores.get(user_id)
+        if old is not None:
+            del self.order[bisect.bisect_left(self.order, (-old, user_id))]
+        bisect.insort(self.order, (-money, user_id))
+        self.scores[user_id] = money
+
+    def money(self, user_id):
+        return self.scores.get(user_id, 0)
+
+    def rank(self, user_id):
+        # 名次 = 比他有錢的人數 + 1 (同分同名次)
+        return bisect.bisect_left(self.order, (-self.money(user_id),)) + 1
+
+    def page(self, page):
+        start = (page - 1) * LEADERBOARD_PAGE_SIZE
+        return [(start + i + 1, user_id, -neg_money) for i, (neg_money, user_id) in enumerate(self.order[start:start + LEADERBOARD_PAGE_SIZE])]
+
+# --- 🧠 餘額快取：指令直接讀寫記憶體，髒資料由背景 flusher 批次寫回 ---
+class BalanceCache:
+    def __init__(self, ledger):
+        self.ledger = ledger
+        self.balances = {}
+        self.dirty = set()
+        self.journal = [] # 還沒寫回的流水帳 (user_id, 金額變動, 原因, 時間)
+        self.pending = 0 # 上次寫回後累積的異動筆數
+        self.loading = {} # 正在從資料庫讀取的使用者 (避免同一人同時 miss 讀兩次)
+        self.wake = asyncio.Event()
+        self.flusher = None
+        self.closing = False
+
+    def start(self):
+        self.flusher = asyncio.create_task(self.flush_loop())
+
+    async def close(self):
+        # 關機/卸載：叫醒 flusher 讓它寫完最後一輪再結束，再保證把剩下的髒資料寫回
+        self.closing = True
+        self.wake.set()
+        if self.flusher:
+            await self.flusher
+        await self.flush()
+
+    async def get(self, user_id):
+        if user_id not in self.balances:
+            task = self.loading.get(user_id)
+            if task is None:
+                task = asyncio.ensure_future(self.ledger.get_balance(user_id))
+                self.loading[user_id] = task
+                task.add_done_callback(lambda _: self.loading.pop(user_id, None))
+            money = await task
+            # 等待期間可能已經有人先放進快取並修改過，不能覆蓋
+            self.balances.setdefault(user_id, money)
+        return self.balances[user_id]
+
+    def reset(self):
+        # 資料庫被重建後，記憶體裡的舊餘額全部作廢 (還沒寫回的除外)
+        self.balances = {user_id: self.balances[user_id] for user_id in self.dirty}
+
+    async def adjust(self, user_id, amount, require=0, reason=None):
+        current = await self.get(user_id)
+        # 從這裡到 return 沒有 await，在 event loop 上就是原子操作
+        if current < require:
+            return None
         new_balance = current + amount
-        self.cursor.execute("UPDATE users SET money = ? WHERE user_id = ?", (new_balance, user_id))
-        
-        self.conn.commit()
+        self.balances[user_id] = new_balance
+        self.dirty.add(user_id)
+        self.journal.append((user_id, amount, reason, int(time.time())))
+        self.pending += 1
+        if self.pending >= FLUSH_THRESHOLD:
+            self.wake.set()
+        return new_balance
+
+    async def flush(self):
+        if not self.dirty:
+            return
+        rows = [(user_id, self.balances[user_id]) for user_id in self.dirty]
+        entries = self.journal
+        self.dirty = set()
+        self.journal = []
+        self.pending = 0
+        try:
+            await self.ledger.write_batch(rows, entries)
+        except Exception as e:
+            # 寫入失敗就放回髒資料，下一輪再試 (流水帳要接在新的前面，維持順序)
+            self.dirty.update(user_id for user_id, _ in rows)
+            self.journal[:0] = entries
+            print(f"❌ 餘額寫回失敗: {e}")
+
+    async def flush_loop(self):
+        while not self.closing:
+            try:
+                await asyncio.wait_for(self.wake.wait(), timeout=FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self.wake.clear()
+            await self.flush()
+
+class Economy(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+        self.ledger = Ledger("economy.db")
+        self.cache = BalanceCache(self.ledger)
+        self.leaderboard = Leaderboard()
+
+    async def cog_load(self):
+        await self.ledger.open()
+        self.leaderboard.load(await self.ledger.load_ranking())
+        self.cache.start()
+        self.snapshot_task.start()
+
+    async def cog_unload(self):
+        self.snapshot_task.cancel()
+        await self.cache.close()
+        await self.ledger.close()
+
+    # --- 小工具：讀取餘額 ---
+    async def get_balance(self, user_id):
+        return await self.cache.get(user_id)
+
+    # --- 小工具：修改餘額 (可以是正數或負數)，回傳新餘額；餘額不足 require 時回傳 None ---
+    async def update_balance(self, user_id, amount, require=0, reason=None):
+        new_balance = await self.cache.adjust(user_id, amount, require, reason)
+        if new_balance is not None:
+            self.leaderboard.update(user_id, new_balance)
+        return new_balance
 
     # ================= 指令區 =================
 
     @commands.command()
     async def balance(self, ctx):
         """查詢餘額"""
-        money = self.get_balance(ctx.author.id)
+        money = await self.get_balance(ctx.author.id)
         
         embed = discord.Embed(title="💰 你的錢包", color=0xf1c40f)
         embed.add_field(name="持有金額", value=f"${money}", inline=False)
@@ -60,33 +318,70 @@ class Economy(commands.Cog):
     async def work(self, ctx):
         """打工賺錢 (有冷卻時間)"""
         earnings = random.randint(10, 100) # 隨機賺 10~100 元
-        self.update_balance(ctx.author.id, earnings)
+        await self.update_balance(ctx.author.id, earnings, reason="work")
         
         await ctx.send(f"🔨 {ctx.author.mention} 辛苦工作了一天，賺到了 **${earnings}** 元！")
 
     @commands.command()
     async def gamble(self, ctx, amount: int):
         """賭博指令：!gamble 100"""
-        user_money = self.get_balance(ctx.author.id)
-
         # 防呆機制
         if amount <= 0:
             await ctx.send("❌ 賭注必須大於 0 元！")
             return
-        if user_money < amount:
+
+        # 賭博邏輯 (50% 機率)：先決定輸贏，再用一條指令「檢查餘額 + 結算」，不會被連點鑽漏洞
+        won = random.random() < 0.5
+        new_balance = await self.update_balance(ctx.author.id, amount if won else -amount, require=amount, reason="gamble")
+
+        if new_balance is None:
             await ctx.send("❌ 你的錢不夠！去 !work 打工吧！")
             return
 
-        # 賭博邏輯 (50% 機率)
-        if random.random() < 0.5:
-            # 贏了
-            win_amount = amount # 贏一倍
-            self.update_balance(ctx.author.id, win_amount)
-            await ctx.send(f"🎰 恭喜！你贏了 **${win_amount}**！現在有 **${user_money + win_amount}**")
+        if won:
+            # 贏了 (贏一倍)
+            await ctx.send(f"🎰 恭喜！你贏了 **${amount}**！現在有 **${new_balance}**")
         else:
             # 輸了
-            self.update_balance(ctx.author.id, -amount)
-            await ctx.send(f"💸 遺憾... 你輸了 **${amount}**。剩餘餘額：**${user_money - amount}**")
+            await ctx.send(f"💸 遺憾... 你輸了 **${amount}**。剩餘餘額：**${new_balance}**")
+
+    @commands.command(aliases=["lb"])
+    async def leaderboard(self, ctx, page: int = 1):
+        """財富排行榜：!leaderboard 2"""
+        total_pages = max(1, -(-len(self.leaderboard) // LEADERBOARD_PAGE_SIZE))
+        page = min(max(page, 1), total_pages)
+
+        medals = {1: "🥇", 2: "🥈", 3: "🥉"}
+        lines = [f"{medals.get(pos, f'`#{pos}`')} <@{user_id}> — **${money}**" for pos, user_id, money in self.leaderboard.page(page)]
+
+        embed = discord.Embed(title="🏆 財富排行榜", description="\n".join(lines) or "還沒有人賺到錢，快去 !work 吧！", color=0xf1c40f)
+        embed.set_footer(text=f"第 {page} / {total_pages} 頁")
+        await ctx.send(embed=embed)
+
+    @commands.command()
+    async def rank(self, ctx, member: discord.Member = None):
+        """查詢排名：!rank 或 !rank @某人"""
+        member = member or ctx.author
+        await ctx.send(f"🏅 {member.display_name} 目前排名第 **{self.leaderboard.rank(member.id)}** 名 (${self.leaderboard.money(member.id)})")
+
+    @commands.command()
+    @commands.is_owner()
+    async def ledger_replay(self, ctx):
+        """從快照 + 流水帳重建所有餘額 (限擁有者)"""
+        await self.cache.flush()
+        count = await self.ledger.replay()
+        self.cache.reset()
+        self.leaderboard.load(await self.ledger.load_ranking())
+        await ctx.send(f"🧾 已從流水帳重建 {count} 位使用者的餘額。")
+
+    # --- 排程：定期拍快照並清掉舊流水帳 ---
+    @tasks.loop(hours=SNAPSHOT_HOURS)
+    async def snapshot_task(self):
+        # 先把記憶體裡的異動寫回，快照才會是最新的
+        await self.cache.flush()
+        removed = await self.ledger.snapshot()
+        if removed:
+            print(f"📸 [經濟] 已拍攝餘額快照，清除 {removed} 筆舊流水帳")
 
     # 處理打工還在冷卻時的錯誤
     @work.error
@@ -0,0 +1,177 @@
+import discord
+from discord.ext import commands
+from google.api_core import exceptions
+from collections import OrderedDict, deque
+import asyncio
+import os
+import random
+import time
+from dotenv import load_dotenv
+
+# --- ⚙️ 額度設定 (照 Gemini 方案調整 .env) ---
+GEMINI_RPM = float(os.getenv("GEMINI_RPM", 10)) # 每分鐘最多幾次請求
+GEMINI_BURST = int(os.getenv("GEMINI_BURST", 3)) # 閒置一陣子後最多可以連發幾次
+GEMINI_CONCURRENCY = int(os.getenv("GEMINI_CONCURRENCY", 4)) # 同時進行中的請求上限
+GEMINI_RETRIES = 3 # 遇到 429 最多重排幾次
+
+# --- 🪣 令牌桶：照固定速率補充，拿不到令牌就等 ---
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate # 每秒補幾個
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def ready(self):
+        self.refill()
+        return self.tokens >= 1 and time.monotonic() >= self.paused_until
+
+    async def take(self):
+        while True:
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            self.refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, delay):
+        # 被 429 了：桶子清空，而且這段時間內誰都不准發
+        self.tokens = 0
+        self.paused_until = max(self.paused_until, time.monotonic() + delay)
+
+class Job:
+    def __init__(self, user_key, func):
+        self.user_key = user_key
+        self.func = func # 真正打 Gemini 的 coroutine function，重試時會再呼叫一次
+        self.future = asyncio.get_running_loop().create_future()
+        self.attempt = 0
+
+# --- 🚦 所有 Gemini 請求都從這裡排隊，模型也統一從這裡拿 ---
+# 其他模組用 self.bot.get_cog('Gemini').get_model(...) / submit(...)，不要直接打 API
+class Gemini(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+        self.bucket = TokenBucket(GEMINI_RPM / 60, GEMINI_BURST)
+        self.slots = asyncio.Semaphore(GEMINI_CONCURRENCY)
+        # 每個使用者一條佇列，輪流各拿一個：一個人狂洗也只會排在自己的隊伍裡
+        self.queues = OrderedDict() # user_key -> deque[Job]
+        self.wake = asyncio.Event()
+        self.dispatcher = None
+        # 模型登記處：(模型名稱, 系統指令) -> GenerativeModel，各模組共用同一個
+        self.genai = None
+        self.models = {}
+        self.models_lock = asyncio.Lock()
+
+    async def cog_load(self):
+        self.dispatcher = asyncio.create_task(self.dispatch_loop())
+
+    async def cog_unload(self):
+        if self.dispatcher:
+            self.dispatcher.cancel()
+        for queue in self.queues.values():
+            for job in queue:
+                job.future.cancel()
+        self.queues.clear()
+
+    def create_model(self, name, system_instruction):
+        # google.generativeai 光 import 就要一秒多，所以等到真的要用才載入 (在執行緒裡跑)
+        if self.genai is None:
+            import google.generativeai as genai
+            load_dotenv(override=True)
+            api_key = os.getenv("GEMINI_API_KEY")
+            if not api_key:
+                raise RuntimeError("找不到 GEMINI_API_KEY")
+            genai.configure(api_key=api_key)
+            self.genai = genai
+        print(f"🚀 正在初始化模型: {name}")
+        return self.genai.GenerativeModel(model_name=name, system_instruction=system_instruction)
+
+    async def get_model(self, name, system_instruction=None):
+        """拿到共用的模型，第一次呼叫時才建立；API Key 有問題會丟例外"""
+        key = (name, system_instruction)
+        if key not in self.models:
+            async with self.models_lock:
+                if key not in self.models:
+                    self.models[key] = await asyncio.to_thread(self.create_model, name, system_instruction)
+        return self.models[key]
+
+    def position(self, user_key):
+        # 粗估前面還有幾個：輪流制之下，別人最多比我多跑「我在自己隊伍裡的名次」那麼多個
+        mine = len(self.queues.get(user_key, ())) - 1
+        ahead = mine + sum(min(len(queue), mine + 1) for key, queue in self.queues.items() if key != user_key)
+        return ahead
+
+    async def submit(self, user_key, func, on_queued=None):
+        """排隊執行 func() 並回傳結果；需要等的話會先呼叫 on_queued(前面幾個)"""
+        job = Job(user_key, func)
+        self.queues.setdefault(user_key, deque()).append(job)
+        self.wake.set()
+
+        ahead = self.position(user_key)
+        if on_queued and (ahead > 0 or not self.bucket.ready()):
+            await on_queued(ahead)
+        return await job.future
+
+    def next_job(self):
+        # 輪到隊伍最前面的使用者，拿完他的一個請求後排到最後面
+        while self.queues:
+            user_key, queue = next(iter(self.queues.items()))
+            job = queue.popleft()
+            if queue:
+                self.queues.move_to_end(user_key)
+            else:
+                del self.queues[user_key]
+            if not job.future.done(): # 呼叫端已經放棄的就跳過
+                return job
+        return None
+
+    async def dispatch_loop(self):
+        while True:
+            await self.slots.acquire()
+            while not self.queues:
+                self.wake.clear()
+                await self.wake.wait()
+            # 先拿令牌再挑人：等令牌的期間新來的使用者也能公平排進來
+            await self.bucket.take()
+            job = self.next_job()
+            if job is None:
+                self.slots.release()
+                continue
+            asyncio.create_task(self.run(job))
+
+    async def run(self, job):
+        try:
+            result = await job.func()
+        except exceptions.ResourceExhausted as e:
+            if job.attempt < GEMINI_RETRIES:
+                # 指數退避 + 隨機抖動，然後插回自己隊伍的最前面
+                delay = min(2 ** (job.attempt + 1), 60) * random.uniform(0.5, 1.5)
+                job.attempt += 1
+                print(f"⏳ [Gemini] 429，{delay:.1f} 秒後重試 (第 {job.attempt} 次)")
+                self.bucket.pause(delay)
+                self.queues.setdefault(job.user_key, deque()).appendleft(job)
+                self.queues.move_to_end(job.user_key, last=False)
+                self.wake.set()
+            elif not job.future.done():
+                job.future.set_exception(e)
+        except Exception as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            self.slots.release()
+
+async def setup(bot):
+    await bot.add_cog(Gemini(bot))
@@ -0,0 +1,92 @@
+import discord
+from discord.ext import commands
+import aiohttp
+import asyncio
+import json
+import random
+
+# 遇到這些狀態碼 (限流 / 伺服器暫時出錯) 會自動重試
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+class HttpResponse:
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body)
+
+# --- 🌐 全機器人共用的 HTTP 連線池 ---
+# 其他模組用 self.bot.get_cog('HttpClient') 取得，不要再自己開 ClientSession
+class HttpClient(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+        self.session = None
+
+    async def cog_load(self):
+        # 一個長期存活的 session：連線會被重複使用 (省掉每次的 DNS + TCP + TLS)
+        connector = aiohttp.TCPConnector(
+            limit=100, # 全部最多 100 條連線
+            limit_per_host=10, # 同一個網站最多 10 條，避免把對方打爆
+            ttl_dns_cache=300 # DNS 結果快取 5 分鐘
+        )
+        timeout = aiohttp.ClientTimeout(total=20, connect=5)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        print("✅ [HTTP] 共用連線池已建立")
+
+    async def cog_unload(self):
+        if self.session:
+            await self.session.close()
+
+    def backoff(self, attempt, retry_after=None):
+        # 對方有說要等多久就照辦，否則指數退避 + 隨機抖動
+        if retry_after:
+            try:
+                return min(float(retry_after), 30)
+            except ValueError:
+                pass
+        return 0.5 * 2 ** attempt + random.uniform(0, 0.5)
+
+    async def read_limited(self, response, max_bytes):
+        # 邊收邊數，超過上限就直接放棄，不會先把整個大檔讀進記憶體
+        if response.content_length and response.content_length > max_bytes:
+            raise ValueError(f"回應太大 ({response.content_length} bytes)")
+        chunks = []
+        size = 0
+        async for chunk in response.content.iter_chunked(64 * 1024):
+            size += len(chunk)
+            if size > max_bytes:
+                raise ValueError(f"回應超過 {max_bytes} bytes")
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+    async def request(self, method, url, retries=2, max_bytes=None, **kwargs):
+        """送出請求並讀完內容，回傳 HttpResponse；網路錯誤或 429/5xx 會自動重試
+        有給 max_bytes 的話，內容超過上限會丟 ValueError"""
+        for attempt in range(retries + 1):
+            try:
+                async with self.session.request(method, url, **kwargs) as response:
+                    if response.status in RETRY_STATUSES and attempt < retries:
+                        await asyncio.sleep(self.backoff(attempt, response.headers.get("Retry-After")))
+                        continue
+                    if max_bytes is None:
+                        body = await response.read()
+                    else:
+                        body = await self.read_limited(response, max_bytes)
+                    return HttpResponse(response.status, response.headers, body)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if attempt >= retries:
+                    raise
+                await asyncio.sleep(self.backoff(attempt))
+
+    async def get_json(self, url, **kwargs):
+        """GET 並解析 JSON，狀態碼不是 200 時回傳 None"""
+        response = await self.request("GET", url, **kwargs)
+        if response.status != 200:
+            print(f"⚠️ [HTTP] {url} 回傳錯誤代碼: {response.status}")
+            return None
+        return response.json()
+
+async def setup(bot):
+    await bot.add_cog(HttpClient(bot))
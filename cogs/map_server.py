@@ -2,8 +2,6 @@ import discord
 from discord.ext import commands
 from discord.ui import Select, View, Button
 from aiohttp import web
-import google.generativeai as genai
-import asyncio
 import os
 import urllib.parse
 
@@ -41,8 +39,6 @@ class PlaceSelect(Select):
 class MapServer(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        api_key = os.getenv("GEMINI_API_KEY")
-        if api_key: genai.configure(api_key=api_key)
 
     async def cog_load(self):
         web_cog = self.bot.get_cog('WebServer')
@@ -60,7 +56,8 @@ class MapServer(commands.Cog):
             msg = await channel.send(f"正在搜尋附近...")
 
             # 2. 呼叫 Gemini (使用最穩定的 flash-latest)
-            model = genai.GenerativeModel('models/gemini-flash-latest')
+            gemini = self.bot.get_cog('Gemini')
+            model = await gemini.get_model('models/gemini-flash-latest')
             prompt = (
                 f"請根據座標 {lat}, {lon} 判斷所在行政區。"
                 f"並推薦 5 個距離此座標 1.5 公里內的「在地美食」或「知名景點」。"
@@ -68,7 +65,8 @@ class MapServer(commands.Cog):
                 f"請嚴格遵守此格式，每行一個地點：名稱|介紹(30字內)|類別|#標籤"
             )
             
-            response = await asyncio.to_thread(model.generate_content, prompt)
+            # 跟聊天共用同一個排程器 (限速 + 429 重試)，地圖推薦自己排一條隊伍
+            response = await gemini.submit("map", lambda: model.generate_content_async(prompt))
             
             # 3. 解析並建立 Embed (讓資訊直接顯示)
             places = []
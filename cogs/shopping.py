@@ -1,7 +1,6 @@
 import discord
 from discord.ext import commands
 from discord.ui import View, Button
-import aiohttp
 import urllib.parse
 
 # --- 翻頁控制器 (改為單張輪播模式) ---
@@ -83,13 +82,10 @@ class Shopping(commands.Cog):
             "Referer": "https://24h.pchome.com.tw/"
         }
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, headers=headers) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        return data.get("prods", [])
-                    else:
-                        return None
+            data = await self.bot.get_cog("HttpClient").get_json(url, headers=headers)
+            if data is None:
+                return None
+            return data.get("prods", [])
         except Exception:
             return None
 
@@ -4,290 +4,875 @@ from discord.ui import Button, View, Modal, TextInput, Select
 import json
 import os
 import uuid
+import asyncio
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
 
-# 🔒 設定你指定的頻道 ID
+# 📦 所有面板 (每個頻道一塊) 都存在這個資料庫
+DB_FILE = "todo.db"
+
+# 🔒 舊版只有一塊面板、存在 JSON 檔：第一次啟動時會把它搬進資料庫，掛在這個頻道下
 TODO_CHANNEL_ID = 1046731966516572240 
 DATA_FILE = "team_todo_list.json"
 
 # --- 🛠️ 資料處理區 (支援階層結構) ---
-def load_data():
-    default_data = {"shared": [], "msg_id": None}
-    if os.path.exists(DATA_FILE):
+# 面板的任務第一次用到時才從資料庫載入記憶體，修改後延遲一下再把「有變動的任務」整批寫回
+SAVE_DELAY = 2.0
+# 面板重繪的合併視窗：這段時間內的多次點擊只會編輯一次訊息
+RENDER_DELAY = 1.0
+# 分頁設定：面板每頁字數上限 (embed 描述上限 4096)、選單每頁選項數 (Discord 上限 25)
+PAGE_CHAR_LIMIT = 3800
+OPTIONS_PER_PAGE = 25
+
+def new_id():
+    return str(uuid.uuid4())[:8]
+
+# --- 💾 資料庫：SQLite 全部丟到專屬執行緒，不卡住 event loop ---
+class TodoDB:
+    def __init__(self, path):
+        self.path = path
+        self.conn = None
+        # 只開一條執行緒：所有讀寫照順序排隊，SQLite 連線也只在這條線上使用
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="todo-db")
+
+    async def run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    async def open(self):
+        await self.run(self._open)
+
+    async def close(self):
+        await self.run(self._close)
+        self.executor.shutdown(wait=True)
+
+    def _open(self):
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        # boards：每個頻道一塊面板；tasks：所有面板的任務，用 board_id / parent_id 建索引
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS boards (
+                board_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                guild_id INTEGER,
+                channel_id INTEGER NOT NULL UNIQUE,
+                message_id INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS idx_boards_guild ON boards (guild_id);
+
+            CREATE TABLE IF NOT EXISTS tasks (
+                board_id INTEGER NOT NULL,
+                task_id TEXT NOT NULL,
+                parent_id TEXT,
+                position INTEGER NOT NULL,
+                task TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'TODO',
+                owner TEXT,
+                expanded INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (board_id, task_id)
+            );
+            CREATE INDEX IF NOT EXISTS idx_tasks_board ON tasks (board_id, position);
+            CREATE INDEX IF NOT EXISTS idx_tasks_parent ON tasks (parent_id);
+        """)
+        self.conn.commit()
+
+    def _close(self):
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+
+    def _list_boards(self):
+        return self.conn.execute("SELECT board_id, guild_id, channel_id, message_id FROM boards").fetchall()
+
+    def _create_board(self, guild_id, channel_id):
+        # 同一個頻道重複 !init_todo 只會拿到原本那塊面板
+        with self.conn:
+            return self.conn.execute("""
+                INSERT INTO boards (guild_id, channel_id) VALUES (?, ?)
+                ON CONFLICT(channel_id) DO UPDATE SET guild_id = COALESCE(excluded.guild_id, guild_id)
+                RETURNING board_id, guild_id, channel_id, message_id
+            """, (guild_id, channel_id)).fetchone()
+
+    def _set_message(self, board_id, message_id):
+        with self.conn:
+            self.conn.execute("UPDATE boards SET message_id = ? WHERE board_id = ?", (message_id, board_id))
+
+    def _load_tasks(self, board_id):
+        return self.conn.execute("""
+            SELECT task_id, parent_id, position, task, status, owner, expanded
+            FROM tasks WHERE board_id = ? ORDER BY position
+        """, (board_id,)).fetchall()
+
+    def _write_tasks(self, board_id, rows, deleted):
+        # 只寫有變動的任務，同一個 transaction；task_id 只在同一塊面板裡唯一，所以一律帶 board_id
+        with self.conn:
+            self.conn.executemany(
+                "DELETE FROM tasks WHERE board_id = ? AND task_id = ?", [(board_id, task_id) for task_id in deleted]
+            )
+            self.conn.executemany("""
+                INSERT INTO tasks (task_id, board_id, parent_id, position, task, status, owner, expanded)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(board_id, task_id) DO UPDATE SET
+                    parent_id = excluded.parent_id, position = excluded.position, task = excluded.task,
+                    status = excluded.status, owner = excluded.owner, expanded = excluded.expanded
+            """, rows)
+
+    async def list_boards(self):
+        return await self.run(self._list_boards)
+
+    async def create_board(self, guild_id, channel_id):
+        return await self.run(self._create_board, guild_id, channel_id)
+
+    async def set_message(self, board_id, message_id):
+        await self.run(self._set_message, board_id, message_id)
+
+    async def load_tasks(self, board_id):
+        return await self.run(self._load_tasks, board_id)
+
+    async def write_tasks(self, board_id, rows, deleted):
+        await self.run(self._write_tasks, board_id, rows, deleted)
+
+# --- 🌲 單一面板的任務樹 (記憶體) ---
+class TodoStore:
+    def __init__(self, db, board_id):
+        self.db = db
+        self.board_id = board_id
+        self.roots = [] # 主任務列表，每個節點底下的 children 就是子任務
+        # 索引：id -> 節點 / 上層 id / 子孫進度 [完成數, 總數]，跟樹一起維護，查找不用再掃整棵樹
+        self.nodes = {}
+        self.parents = {}
+        self.progress = {}
+        # 每個主任務區塊的版本戳記：區塊內有任何變動就換新戳記，面板只重繪有變的區塊
+        self.versions = {}
+        self.revision = 0
+        self.next_position = 0 # 排序用：新增/移動的任務排在同層最後
+        # 等待寫回的任務 id
+        self.changed = set()
+        self.deleted = set()
+        self.save_task = None
+
+    async def load(self):
+        rows = await self.db.load_tasks(self.board_id)
+        nodes = {}
+        for task_id, parent_id, position, task, status, owner, expanded in rows:
+            nodes[task_id] = {
+                "id": task_id,
+                "task": task,
+                "status": status,
+                "owner": owner,
+                "children": [],
+                "expanded": bool(expanded),
+                "position": position
+            }
+            self.next_position = max(self.next_position, position + 1)
+        # 已經依 position 排好，照順序掛回上層就是畫面順序 (上層不見的就當主任務)
+        for task_id, parent_id, *_ in rows:
+            parent = nodes.get(parent_id)
+            (parent["children"] if parent else self.roots).append(nodes[task_id])
+            if parent_id is not None and parent is None:
+                self.changed.add(task_id)
+
+        for item in self.roots:
+            self._index(item, None)
+            self._touch(item["id"])
+
+    def _index(self, node, parent_id):
+        self.nodes[node["id"]] = node
+        self.parents[node["id"]] = parent_id
+        self.progress[node["id"]] = [0, 0]
+        for child in node["children"]:
+            self._index(child, node["id"])
+            done, total = self._weight(child["id"])
+            self.progress[node["id"]][0] += done
+            self.progress[node["id"]][1] += total
+
+    def _unindex(self, node):
+        for child in node["children"]:
+            self._unindex(child)
+        del self.nodes[node["id"]], self.parents[node["id"]], self.progress[node["id"]]
+
+    def _weight(self, node_id):
+        # 這個節點 (連同子孫) 要算進上層進度的 [完成數, 總數]
+        done, total = self.progress[node_id]
+        return done + (self.nodes[node_id]["status"] == "DONE"), total + 1
+
+    def _roll_up(self, parent_id, done, total):
+        # 進度變化一路往上加，只走祖先鏈，不用重算整棵樹
+        while parent_id is not None:
+            self.progress[parent_id][0] += done
+            self.progress[parent_id][1] += total
+            parent_id = self.parents[parent_id]
+
+    def _touch(self, node_id):
+        # 找到所屬的主任務，換一個新的版本戳記 (全域遞增，不會跟舊快取撞號)
+        while self.parents[node_id] is not None:
+            node_id = self.parents[node_id]
+        self.revision += 1
+        self.versions[node_id] = self.revision
+
+    def _siblings(self, parent_id):
+        return self.roots if parent_id is None else self.nodes[parent_id]["children"]
+
+    def _detach(self, node):
+        siblings = self._siblings(self.parents[node["id"]])
+        del siblings[next(i for i, x in enumerate(siblings) if x is node)]
+
+    def walk(self, visible_only=False, roots=None):
+        """依畫面順序走訪 (層級, 節點)；visible_only 時略過收起來的子項，roots 可指定只走某幾棵子樹"""
+        stack = [(0, node) for node in reversed(self.roots if roots is None else roots)]
+        while stack:
+            depth, node = stack.pop()
+            yield depth, node
+            if node["expanded"] or not visible_only:
+                stack.extend((depth + 1, child) for child in reversed(node["children"]))
+
+    def in_subtree(self, node_id, root_id):
+        # 沿著上層指標往上找，看 node_id 是不是 root_id 本身或它的子孫
+        while node_id is not None:
+            if node_id == root_id:
+                return True
+            node_id = self.parents[node_id]
+        return False
+
+    def add(self, parent_id, task, owner):
+        if parent_id is not None and parent_id not in self.nodes:
+            return None
+        # id 只有 8 碼，同一塊面板裡撞到就重抽
+        node_id = new_id()
+        while node_id in self.nodes:
+            node_id = new_id()
+        node = {
+            "id": node_id,
+            "task": task,
+            "status": "TODO",
+            "owner": owner,
+            "children": [], # 子任務列表
+            "expanded": True, # 預設展開方便看
+            "position": self._take_position()
+        }
+        self._siblings(parent_id).append(node)
+        self.nodes[node["id"]] = node
+        self.parents[node["id"]] = parent_id
+        self.progress[node["id"]] = [0, 0]
+        self._roll_up(parent_id, 0, 1)
+        if parent_id is not None:
+            self.nodes[parent_id]["expanded"] = True # 新增時自動展開
+        self._touch(node["id"])
+        self.mark_dirty(node["id"])
+        if parent_id is not None:
+            self.mark_dirty(parent_id)
+        return node
+
+    def remove(self, node_id):
+        node = self.nodes.get(node_id)
+        if not node:
+            return False
+        parent_id = self.parents[node_id]
+        done, total = self._weight(node_id)
+        if parent_id is None:
+            del self.versions[node_id]
+        else:
+            self._touch(parent_id)
+        removed = [x["id"] for _, x in self.walk(roots=[node])]
+        self._detach(node)
+        self._roll_up(parent_id, -done, -total)
+        self._unindex(node)
+        self.changed.difference_update(removed)
+        self.deleted.update(removed)
+        self.mark_dirty()
+        return True
+
+    def move(self, node_id, new_parent_id):
+        node = self.nodes.get(node_id)
+        if not node or (new_parent_id is not None and new_parent_id not in self.nodes):
+            return False
+        if self.in_subtree(new_parent_id, node_id):
+            return False # 不能移到自己底下
+        done, total = self._weight(node_id)
+        old_parent_id = self.parents[node_id]
+        if old_parent_id is None:
+            del self.versions[node_id]
+        else:
+            self._touch(old_parent_id)
+        self._detach(node)
+        self._roll_up(old_parent_id, -done, -total)
+        node["position"] = self._take_position()
+        self._siblings(new_parent_id).append(node)
+        self.parents[node_id] = new_parent_id
+        self._roll_up(new_parent_id, done, total)
+        if new_parent_id is not None:
+            self.nodes[new_parent_id]["expanded"] = True
+            self.mark_dirty(new_parent_id)
+        self._touch(node_id)
+        self.mark_dirty(node_id)
+        return True
+
+    def toggle_expanded(self, node_id):
+        node = self.nodes.get(node_id)
+        if node:
+            node["expanded"] = not node["expanded"]
+            self._touch(node_id)
+            self.mark_dirty(node_id)
+
+    def toggle_status(self, node_id):
+        node = self.nodes.get(node_id)
+        if node:
+            node["status"] = "TODO" if node["status"] == "DONE" else "DONE"
+            self._roll_up(self.parents[node_id], 1 if node["status"] == "DONE" else -1, 0)
+            self._touch(node_id)
+            self.mark_dirty(node_id)
+
+    def _take_position(self):
+        self.next_position += 1
+        return self.next_position - 1
+
+    def mark_dirty(self, node_id=None):
+        if node_id is not None:
+            self.changed.add(node_id)
+        if self.save_task is None or self.save_task.done():
+            self.save_task = asyncio.create_task(self._save_later())
+
+    async def _save_later(self):
+        await asyncio.sleep(SAVE_DELAY)
+        await self.flush()
+
+    async def flush(self):
+        if not self.changed and not self.deleted:
+            return
+        rows = []
+        for task_id in self.changed:
+            node = self.nodes[task_id]
+            rows.append((task_id, self.board_id, self.parents[task_id], node["position"], node["task"], node["status"], node["owner"], int(node["expanded"])))
+        changed, deleted = self.changed, self.deleted
+        self.changed, self.deleted = set(), set()
         try:
-            with open(DATA_FILE, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                # 資料結構遷移檢查：確保舊資料有 id 和 children 欄位
-                for item in data.get("shared", []):
-                    if "id" not in item: item["id"] = str(uuid.uuid4())[:8]
-                    if "children" not in item: item["children"] = []
-                    if "expanded" not in item: item["expanded"] = False
-                return data
-        except:
-            return default_data
-    return default_data
-
-def save_data(data):
-    with open(DATA_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=4)
+            # shield：就算呼叫端被取消，已經排隊的這次寫入也一定會寫完
+            await asyncio.shield(self.db.write_tasks(self.board_id, rows, list(deleted)))
+        except Exception as e:
+            self.changed |= {task_id for task_id in changed if task_id in self.nodes}
+            self.deleted |= deleted
+            print(f"❌ 儲存待辦清單失敗: {e}")
+
+    async def close(self):
+        if self.save_task and not self.save_task.done():
+            self.save_task.cancel()
+        await self.flush()
 
 # --- 📝 1. 新增主任務 Modal ---
 class AddTaskModal(Modal, title="新增主任務"):
     task_content = TextInput(label="主任務內容", placeholder="例如：【重要時程】專題指導", max_length=100)
     owner_name = TextInput(label="負責人", placeholder="選填", required=False, max_length=20)
 
-    def __init__(self, cog):
+    def __init__(self, board):
         super().__init__()
-        self.cog = cog
+        self.board = board
 
     async def on_submit(self, interaction: discord.Interaction):
         await interaction.response.defer()
-        data = load_data()
         owner = self.owner_name.value if self.owner_name.value else interaction.user.display_name
-        
-        new_item = {
-            "id": str(uuid.uuid4())[:8],
-            "task": self.task_content.value,
-            "status": "TODO",
-            "owner": owner,
-            "children": [], # 子任務列表
-            "expanded": True # 預設展開方便看
-        }
-        data["shared"].append(new_item)
-        save_data(data)
-        await self.cog.update_dashboard()
+        self.board.store.add(None, self.task_content.value, owner)
+        await self.board.update_dashboard()
 
-# --- 📝 2. 新增子任務 (兩步驟：先選父任務 -> 再填內容) ---
+# --- 📝 2. 新增子任務 (兩步驟：先選父任務 -> 再填內容，任何一層都可以再往下加) ---
 class AddSubTaskModal(Modal, title="新增子項目"):
     subtask_content = TextInput(label="子項目內容", placeholder="例如：繳交文件", max_length=100)
 
-    def __init__(self, cog, parent_id):
+    def __init__(self, board, parent_id):
         super().__init__()
-        self.cog = cog
+        self.board = board
         self.parent_id = parent_id
 
     async def on_submit(self, interaction: discord.Interaction):
         await interaction.response.defer()
-        data = load_data()
-        
-        # 尋找對應的父任務
-        for item in data["shared"]:
-            if item["id"] == self.parent_id:
-                new_sub = {
-                    "id": str(uuid.uuid4())[:8],
-                    "task": self.subtask_content.value,
-                    "status": "TODO",
-                    "owner": interaction.user.display_name
-                }
-                item["children"].append(new_sub)
-                item["expanded"] = True # 新增時自動展開
-                break
-        
-        save_data(data)
-        await self.cog.update_dashboard()
-
-class SelectParentView(View):
-    def __init__(self, tasks, cog):
+        self.board.store.add(self.parent_id, self.subtask_content.value, interaction.user.display_name)
+        await self.board.update_dashboard()
+
+def option_label(depth, node, width=25):
+    # 用縮排表示層級
+    prefix = "　" * depth + ("└ " if depth else "")
+    return f"{prefix}{node['task'][:width]}"
+
+# --- 📑 分頁選單：選項超過 25 個時用 ◀ ▶ 翻頁，所有任務都選得到 ---
+class PagedSelectView(View):
+    def __init__(self, make_select, options):
         super().__init__()
-        options = []
-        for task in tasks[:25]:
-            options.append(discord.SelectOption(label=task["task"][:25], value=task["id"], emoji="📂"))
-        
-        self.add_item(ParentSelect(options, cog))
+        self.make_select = make_select
+        self.options = options
+        self.page = 0
+        self.total_pages = max(1, -(-len(options) // OPTIONS_PER_PAGE))
+        self.select = None
+        if self.total_pages == 1:
+            self.remove_item(self.prev_page)
+            self.remove_item(self.next_page)
+        self.show_page()
+
+    def show_page(self):
+        if self.select:
+            self.remove_item(self.select)
+        start = self.page * OPTIONS_PER_PAGE
+        self.select = self.make_select(self.options[start:start + OPTIONS_PER_PAGE])
+        if self.total_pages > 1:
+            self.select.placeholder = f"{self.select.placeholder} ({self.page + 1}/{self.total_pages})"
+        self.add_item(self.select)
+
+    @discord.ui.button(label="◀", style=discord.ButtonStyle.secondary, row=1)
+    async def prev_page(self, interaction: discord.Interaction, button: Button):
+        self.page = (self.page - 1) % self.total_pages
+        self.show_page()
+        await interaction.response.edit_message(view=self)
+
+    @discord.ui.button(label="▶", style=discord.ButtonStyle.secondary, row=1)
+    async def next_page(self, interaction: discord.Interaction, button: Button):
+        self.page = (self.page + 1) % self.total_pages
+        self.show_page()
+        await interaction.response.edit_message(view=self)
+
+def parent_options(store):
+    return [discord.SelectOption(label=option_label(depth, node), value=node["id"], emoji="📂") for depth, node in store.walk()]
 
 class ParentSelect(Select):
-    def __init__(self, options, cog):
-        self.cog = cog
-        super().__init__(placeholder="請選擇要加入到哪個主任務下...", options=options)
+    def __init__(self, board, options):
+        self.board = board
+        super().__init__(placeholder="請選擇要加入到哪個任務下...", options=options, row=0)
 
     async def callback(self, interaction: discord.Interaction):
         # 選完父任務後，跳出 Modal 填寫內容
-        await interaction.response.send_modal(AddSubTaskModal(self.cog, self.values[0]))
+        await interaction.response.send_modal(AddSubTaskModal(self.board, self.values[0]))
 
 # --- 📂 3. 展開/收起 控制器 ---
-class ToggleExpandSelect(Select):
-    def __init__(self, tasks, cog):
-        self.cog = cog
-        options = []
-        for task in tasks[:25]:
+def toggle_options(store):
+    options = []
+    for depth, node in store.walk(visible_only=True):
+        # 主任務，或底下有子項的項目才需要展開/收起
+        if depth == 0 or node["children"]:
             # 根據目前狀態顯示不同圖示
-            icon = "▾" if task.get("expanded", False) else "▸"
-            label = f"{icon} {task['task'][:23]}"
-            options.append(discord.SelectOption(label=label, value=task["id"]))
+            icon = "▾" if node["expanded"] else "▸"
+            options.append(discord.SelectOption(label=f"{icon} {option_label(depth, node, 23)}", value=node["id"]))
+    return options
 
-        super().__init__(placeholder="點擊切換 展開/收起 狀態...", min_values=1, max_values=1, options=options)
+class ToggleExpandSelect(Select):
+    def __init__(self, board, options):
+        self.board = board
+        super().__init__(placeholder="點擊切換 展開/收起 狀態...", min_values=1, max_values=1, options=options, row=0)
 
     async def callback(self, interaction: discord.Interaction):
         await interaction.response.defer()
-        data = load_data()
-        target_id = self.values[0]
-        
-        for item in data["shared"]:
-            if item["id"] == target_id:
-                # 切換布林值
-                item["expanded"] = not item.get("expanded", False)
-                break
-        
-        save_data(data)
-        await self.cog.update_dashboard()
+        self.board.store.toggle_expanded(self.values[0])
+        await self.board.update_dashboard()
         # 隱藏選單
         await interaction.edit_original_response(content="✅ 狀態已切換", view=None)
 
-class ToggleView(View):
-    def __init__(self, tasks, cog):
-        super().__init__()
-        self.add_item(ToggleExpandSelect(tasks, cog))
+# --- ☑️ 4. 標記完成 (進度會自動累計到上層) ---
+def status_options(store):
+    options = []
+    for depth, node in store.walk(visible_only=True):
+        icon = "☑" if node["status"] == "DONE" else "◻"
+        options.append(discord.SelectOption(label=f"{icon} {option_label(depth, node, 23)}", value=node["id"]))
+    return options
 
-# --- 🗑️ 4. 完成/刪除 (扁平化顯示所有任務) ---
-class DeleteSelect(Select):
-    def __init__(self, data_list, cog):
-        self.cog = cog
-        options = []
-        
-        # 將樹狀結構扁平化以便列表
-        # 格式：主任務 (ID) 或 主任務 > 子任務 (ID)
-        count = 0
-        for p in data_list:
-            if count >= 25: break
+class StatusSelect(Select):
+    def __init__(self, board, options):
+        self.board = board
+        super().__init__(placeholder="點擊切換 完成/未完成...", min_values=1, max_values=1, options=options, row=0)
+
+    async def callback(self, interaction: discord.Interaction):
+        await interaction.response.defer()
+        self.board.store.toggle_status(self.values[0])
+        await self.board.update_dashboard()
+        await interaction.edit_original_response(content="✅ 進度已更新", view=None)
+
+# --- 🗑️ 5. 刪除 (扁平化顯示所有看得到的任務) ---
+def delete_options(store):
+    # 將樹狀結構扁平化以便列表 (只列出展開中的項目，避免列表太長)
+    options = []
+    for depth, node in store.walk(visible_only=True):
+        if depth == 0:
             options.append(discord.SelectOption(
-                label=f"🗑️ 主：{p['task'][:20]}", 
-                value=f"parent:{p['id']}", 
+                label=f"🗑️ 主：{node['task'][:20]}", 
+                value=node["id"], 
                 description="刪除此主任務與底下所有子項"
             ))
-            count += 1
-            if p.get("expanded", False): # 只有展開時才讓選子任務(避免列表太長)
-                for c in p["children"]:
-                    if count >= 25: break
-                    options.append(discord.SelectOption(
-                        label=f"　└ {c['task'][:20]}", 
-                        value=f"child:{p['id']}:{c['id']}", 
-                        description="刪除此子項目"
-                    ))
-                    count += 1
-
-        super().__init__(placeholder="選擇要刪除的項目...", min_values=1, max_values=1, options=options)
+        else:
+            options.append(discord.SelectOption(
+                label=option_label(depth, node, 20), 
+                value=node["id"], 
+                description="刪除此子項目 (含底下子項)"
+            ))
+    return options
+
+class DeleteSelect(Select):
+    def __init__(self, board, options):
+        self.board = board
+        super().__init__(placeholder="選擇要刪除的項目...", min_values=1, max_values=1, options=options, row=0)
 
     async def callback(self, interaction: discord.Interaction):
         await interaction.response.defer()
-        data = load_data()
-        action_type, *ids = self.values[0].split(":")
-        
-        if action_type == "parent":
-            # 刪除主任務
-            data["shared"] = [x for x in data["shared"] if x["id"] != ids[0]]
-        elif action_type == "child":
-            # 刪除子任務
-            pid, cid = ids
-            for p in data["shared"]:
-                if p["id"] == pid:
-                    p["children"] = [x for x in p["children"] if x["id"] != cid]
-                    break
-        
-        save_data(data)
-        await self.cog.update_dashboard()
+        self.board.store.remove(self.values[0])
+        await self.board.update_dashboard()
         await interaction.edit_original_response(content="🗑️ 已移除項目", view=None)
 
-class DeleteView(View):
-    def __init__(self, tasks, cog):
-        super().__init__()
-        self.add_item(DeleteSelect(tasks, cog))
+# --- 🔀 6. 移動 (兩步驟：先選項目 -> 再選新的上層) ---
+def move_options(store):
+    return [discord.SelectOption(label=option_label(depth, node), value=node["id"]) for depth, node in store.walk(visible_only=True)]
+
+def move_target_options(store, node_id):
+    options = [discord.SelectOption(label="📌 最上層 (變成主任務)", value="root")]
+    for depth, node in store.walk():
+        # 不能移到自己或自己的子孫底下
+        if not store.in_subtree(node["id"], node_id):
+            options.append(discord.SelectOption(label=option_label(depth, node), value=node["id"], emoji="📂"))
+    return options
 
-# --- 🎛️ 5. 主面板 ---
+class MoveSelect(Select):
+    def __init__(self, board, options):
+        self.board = board
+        super().__init__(placeholder="選擇要移動的項目...", min_values=1, max_values=1, options=options, row=0)
+
+    async def callback(self, interaction: discord.Interaction):
+        node_id = self.values[0]
+        view = PagedSelectView(lambda options: MoveTargetSelect(self.board, node_id, options), move_target_options(self.board.store, node_id))
+        await interaction.response.edit_message(content="要移到哪裡？", view=view)
+
+class MoveTargetSelect(Select):
+    def __init__(self, board, node_id, options):
+        self.board = board
+        self.node_id = node_id
+        super().__init__(placeholder="選擇新的上層任務...", min_values=1, max_values=1, options=options, row=0)
+
+    async def callback(self, interaction: discord.Interaction):
+        await interaction.response.defer()
+        target = None if self.values[0] == "root" else self.values[0]
+        moved = self.board.store.move(self.node_id, target)
+        await self.board.update_dashboard()
+        await interaction.edit_original_response(content="🔀 已移動項目" if moved else "❌ 無法移動到這裡", view=None)
+
+# --- 🎛️ 7. 主面板 (所有面板共用同一組按鈕，依訊息找到對應的面板) ---
 class DashboardView(View):
     def __init__(self, cog):
         super().__init__(timeout=None)
         self.cog = cog
 
+    async def resolve(self, interaction: discord.Interaction, empty_message=None):
+        board = await self.cog.board_for(interaction)
+        if not board:
+            await interaction.response.send_message("❌ 找不到這塊面板，請在頻道內重新輸入 !init_todo", ephemeral=True)
+            return None
+        if empty_message and not board.store.nodes:
+            await interaction.response.send_message(empty_message, ephemeral=True)
+            return None
+        return board
+
     @discord.ui.button(label="➕ 主任務", style=discord.ButtonStyle.primary, custom_id="todo:add_parent", emoji="📁")
     async def add_parent(self, interaction: discord.Interaction, button: Button):
-        await interaction.response.send_modal(AddTaskModal(self.cog))
+        board = await self.resolve(interaction)
+        if not board: return
+        await interaction.response.send_modal(AddTaskModal(board))
 
     @discord.ui.button(label="➕ 子項目", style=discord.ButtonStyle.success, custom_id="todo:add_child", emoji="📄")
     async def add_child(self, interaction: discord.Interaction, button: Button):
-        data = load_data()
-        if not data["shared"]:
-            return await interaction.response.send_message("❌ 請先建立主任務！", ephemeral=True)
-        await interaction.response.send_message("請選擇要加入哪個主任務：", view=SelectParentView(data["shared"], self.cog), ephemeral=True)
+        board = await self.resolve(interaction, "❌ 請先建立主任務！")
+        if not board: return
+        await interaction.response.send_message("請選擇要加入哪個任務：", view=PagedSelectView(lambda options: ParentSelect(board, options), parent_options(board.store)), ephemeral=True)
 
     @discord.ui.button(label="📂 展開/收起", style=discord.ButtonStyle.secondary, custom_id="todo:toggle", emoji="🔻")
     async def toggle_expand(self, interaction: discord.Interaction, button: Button):
-        data = load_data()
-        if not data["shared"]: return await interaction.response.send_message("❌ 沒東西可以展開", ephemeral=True)
-        await interaction.response.send_message("選擇要切換顯示的任務：", view=ToggleView(data["shared"], self.cog), ephemeral=True)
+        board = await self.resolve(interaction, "❌ 沒東西可以展開")
+        if not board: return
+        await interaction.response.send_message("選擇要切換顯示的任務：", view=PagedSelectView(lambda options: ToggleExpandSelect(board, options), toggle_options(board.store)), ephemeral=True)
 
     @discord.ui.button(label="🗑️ 移除", style=discord.ButtonStyle.danger, custom_id="todo:del", emoji="🗑️")
     async def delete_item(self, interaction: discord.Interaction, button: Button):
-        data = load_data()
-        if not data["shared"]: return await interaction.response.send_message("💤 目前是空的", ephemeral=True)
-        await interaction.response.send_message("請選擇要移除的項目：", view=DeleteView(data["shared"], self.cog), ephemeral=True)
+        board = await self.resolve(interaction, "💤 目前是空的")
+        if not board: return
+        await interaction.response.send_message("請選擇要移除的項目：", view=PagedSelectView(lambda options: DeleteSelect(board, options), delete_options(board.store)), ephemeral=True)
 
     @discord.ui.button(label="🔄", style=discord.ButtonStyle.secondary, custom_id="todo:refresh")
     async def refresh(self, interaction: discord.Interaction, button: Button):
+        board = await self.resolve(interaction)
+        if not board: return
+        await interaction.response.defer()
+        await board.update_dashboard(force=True)
+
+    @discord.ui.button(label="完成", style=discord.ButtonStyle.success, custom_id="todo:done", emoji="☑️")
+    async def mark_done(self, interaction: discord.Interaction, button: Button):
+        board = await self.resolve(interaction, "💤 目前是空的")
+        if not board: return
+        await interaction.response.send_message("選擇要切換完成狀態的項目：", view=PagedSelectView(lambda options: StatusSelect(board, options), status_options(board.store)), ephemeral=True)
+
+    @discord.ui.button(label="移動", style=discord.ButtonStyle.secondary, custom_id="todo:move", emoji="🔀")
+    async def move_item(self, interaction: discord.Interaction, button: Button):
+        board = await self.resolve(interaction, "💤 目前是空的")
+        if not board: return
+        await interaction.response.send_message("請選擇要移動的項目：", view=PagedSelectView(lambda options: MoveSelect(board, options), move_options(board.store)), ephemeral=True)
+
+    @discord.ui.button(label="◀", style=discord.ButtonStyle.secondary, custom_id="todo:prev_page")
+    async def prev_page(self, interaction: discord.Interaction, button: Button):
+        board = await self.resolve(interaction)
+        if not board: return
         await interaction.response.defer()
-        await self.cog.update_dashboard()
+        await board.change_page(-1)
 
-# --- ⚙️ 主要邏輯 ---
-class Todo(commands.Cog):
-    def __init__(self, bot):
-        self.bot = bot
+    @discord.ui.button(label="▶", style=discord.ButtonStyle.secondary, custom_id="todo:next_page")
+    async def next_page(self, interaction: discord.Interaction, button: Button):
+        board = await self.resolve(interaction)
+        if not board: return
+        await interaction.response.defer()
+        await board.change_page(1)
 
-    async def cog_load(self):
-        self.bot.add_view(DashboardView(self))
+# --- 📋 單一面板：任務資料 + 面板訊息的重繪狀態 ---
+class Board:
+    def __init__(self, cog, board_id, guild_id, channel_id, message_id):
+        self.cog = cog
+        self.board_id = board_id
+        self.guild_id = guild_id
+        self.channel_id = channel_id
+        self.message_id = message_id
+        self.store = TodoStore(cog.db, board_id)
+        self.loaded = False
+        self.load_lock = asyncio.Lock()
+
+        # 重繪排程狀態
+        self.render_task = None
+        self.render_pending = False
+        self.render_force = False
+        self.message = None # 快取面板訊息 (PartialMessage)，不用每次 fetch
+        self.last_render = None # 上次送出的 embed 內容，一樣就不重送
+
+        # 分頁狀態與快取
+        self.page = 0
+        self.page_count = 1
+        self.block_cache = {} # 主任務 id -> (版本戳記, 該區塊的文字)
+        self.page_cache = {} # 頁碼 -> (該頁包含的區塊戳記, 該頁文字)
+
+    async def ensure_loaded(self):
+        # 同時有好幾個人點同一塊還沒載入的面板，也只會讀一次資料庫
+        async with self.load_lock:
+            if not self.loaded:
+                await self.store.load()
+                self.loaded = True
+
+    async def close(self):
+        if self.render_task and not self.render_task.done():
+            self.render_task.cancel()
+        if self.loaded:
+            await self.store.close()
+
+    async def update_dashboard(self, force=False):
+        """要求重繪面板：只排程，不會馬上打 API"""
+        self.render_pending = True
+        self.render_force = self.render_force or force
+        if self.render_task is None or self.render_task.done():
+            self.render_task = asyncio.create_task(self.render_loop())
+
+    async def render_loop(self):
+        # 重繪途中又有新要求，就再等一輪合併後重繪
+        while self.render_pending:
+            await asyncio.sleep(RENDER_DELAY)
+            self.render_pending = False
+            force, self.render_force = self.render_force, False
+            try:
+                await self.render_dashboard(force)
+            except Exception as e:
+                print(f"❌ 更新待辦面板失敗: {e}")
+
+    def format_line(self, depth, node):
+        # 有子項的顯示子孫完成進度 (已經算好的，不用再走一次子樹)
+        done, total = self.store.progress[node["id"]]
+        rollup = f" ({done}/{total})" if total else ""
+        arrow = "▾" if node["expanded"] else "▸"
+        if depth == 0:
+            check = " ✅" if node["status"] == "DONE" else ""
+            return f"`{arrow} {node['task']}`{rollup}{check}"
+        box = "☑" if node["status"] == "DONE" else "◻"
+        arrow = f"{arrow} " if node["children"] else ""
+        return f"> {'　' * depth}└ {box} {arrow}{node['task']}{rollup}"
+
+    def render_block(self, root):
+        lines = []
+        for depth, node in self.store.walk(visible_only=True, roots=[root]):
+            lines.append(self.format_line(depth, node))
+        if root["expanded"] and not root["children"]:
+            lines.append(f"> 　└ *[無子項目]*")
+        return "\n".join(lines)
+
+    def render_pages(self):
+        # 1. 每個主任務一個區塊，版本沒變就直接用快取
+        blocks = []
+        for root in self.store.roots:
+            stamp = self.store.versions[root["id"]]
+            cached = self.block_cache.get(root["id"])
+            if cached is None or cached[0] != stamp:
+                cached = (stamp, self.render_block(root))
+                self.block_cache[root["id"]] = cached
+            blocks.append(((root["id"], stamp), cached[1]))
+        for root_id in self.block_cache.keys() - self.store.versions.keys():
+            del self.block_cache[root_id]
+
+        # 2. 依字數把區塊裝進各頁 (區塊盡量不拆開，單一區塊太長才逐行切)
+        pages, current, size = [], [], 0
+        for key, text in blocks:
+            pieces = [text] if len(text) <= PAGE_CHAR_LIMIT else self.split_lines(text)
+            for piece in pieces:
+                if current and size + len(piece) + 2 > PAGE_CHAR_LIMIT:
+                    pages.append(current)
+                    current, size = [], 0
+                current.append((key, piece))
+                size += len(piece) + 2
+        if current:
+            pages.append(current)
+
+        # 3. 只有內容變動的頁面才重新組字
+        texts = []
+        for index, page in enumerate(pages):
+            signature = tuple(key for key, _ in page)
+            cached = self.page_cache.get(index)
+            if cached is None or cached[0] != signature:
+                cached = (signature, "\n\n".join(piece for _, piece in page))
+                self.page_cache[index] = cached
+            texts.append(cached[1])
+        for index in [i for i in self.page_cache if i >= len(pages)]:
+            del self.page_cache[index]
+        return texts
+
+    def split_lines(self, text):
+        pieces, current, size = [], [], 0
+        for line in text.split("\n"):
+            if current and size + len(line) + 1 > PAGE_CHAR_LIMIT:
+                pieces.append("\n".join(current))
+                current, size = [], 0
+            current.append(line)
+            size += len(line) + 1
+        pieces.append("\n".join(current))
+        return pieces
+
+    def build_embed(self):
+        embed = discord.Embed(title="🚀 專案進度追蹤 (階層版)", description="使用下方按鈕管理專案結構", color=discord.Color.blue())
 
-    async def update_dashboard(self):
-        channel = self.bot.get_channel(TODO_CHANNEL_ID)
-        if not channel: return
+        pages = self.render_pages() or ["🎉 目前沒有任務，請新增！"]
+        self.page_count = len(pages)
+        self.page = min(self.page, self.page_count - 1)
 
-        data = load_data()
-        tasks = data.get("shared", [])
-        msg_id = data.get("msg_id")
+        embed.description = pages[self.page]
+        embed.set_footer(text=f"第 {self.page + 1} / {self.page_count} 頁 • 點擊「📂 展開/收起」來控制箭頭")
+        return embed
 
-        embed = discord.Embed(title="🚀 專案進度追蹤 (階層版)", description="使用下方按鈕管理專案結構", color=discord.Color.blue())
-        
-        content_lines = []
-        if tasks:
-            for i, p in enumerate(tasks):
-                # 判斷箭頭方向
-                arrow = "▾" if p.get("expanded", True) else "▸"
-                # 主任務行
-                content_lines.append(f"`{arrow} {p['task']}`")
-                
-                # 如果展開，顯示子任務
-                if p.get("expanded", True):
-                    if p["children"]:
-                        for c in p["children"]:
-                            content_lines.append(f"> 　└ ◻ {c['task']}")
-                    else:
-                        content_lines.append(f"> 　└ *[無子項目]*")
-                
-                content_lines.append("") # 空行分隔
-        else:
-            content_lines = ["🎉 目前沒有任務，請新增！"]
-
-        # 組合內容 (防止過長)
-        final_text = "\n".join(content_lines)
-        if len(final_text) > 4000: final_text = final_text[:3900] + "\n...(內容過長)"
-        
-        embed.description = final_text
-        embed.set_footer(text="點擊「📂 展開/收起」來控制箭頭")
+    async def change_page(self, step):
+        self.page = (self.page + step) % self.page_count
+        await self.update_dashboard()
+
+    async def render_dashboard(self, force=False):
+        channel = self.cog.bot.get_channel(self.channel_id)
+        if not channel: return
+
+        embed = self.build_embed()
+        # 時間戳記以外的內容都沒變，就不浪費一次編輯額度
+        rendered = json.dumps(embed.to_dict(), ensure_ascii=False, sort_keys=True)
+        if not force and rendered == self.last_render:
+            return
         embed.timestamp = discord.utils.utcnow()
 
-        if msg_id:
+        if self.message is None and self.message_id:
+            self.message = channel.get_partial_message(self.message_id)
+
+        if self.message:
             try:
-                msg = await channel.fetch_message(msg_id)
-                await msg.edit(embed=embed, view=DashboardView(self))
+                await self.message.edit(embed=embed, view=self.cog.view)
+                self.last_render = rendered
                 return
             except discord.NotFound:
-                pass
+                self.message = None
+
+        msg = await channel.send(embed=embed, view=self.cog.view)
+        self.message = channel.get_partial_message(msg.id)
+        self.last_render = rendered
+        self.cog.board_by_message.pop(self.message_id, None)
+        self.message_id = msg.id
+        self.cog.board_by_message[msg.id] = self.board_id
+        await self.cog.db.set_message(self.board_id, msg.id)
+
+# --- ⚙️ 主要邏輯 ---
+class Todo(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+        self.db = TodoDB(DB_FILE)
+        self.view = DashboardView(self)
+        # 面板基本資料開機就載入 (很小)，任務等第一次用到才載入
+        self.boards = {} # board_id -> Board
+        self.board_by_channel = {}
+        self.board_by_message = {}
 
-        msg = await channel.send(embed=embed, view=DashboardView(self))
-        data["msg_id"] = msg.id
-        save_data(data)
+    async def cog_load(self):
+        await self.db.open()
+        for row in await self.db.list_boards():
+            self.register_board(*row)
+        await self.migrate_legacy_file()
+        self.bot.add_view(self.view)
+
+    async def cog_unload(self):
+        for board in self.boards.values():
+            await board.close()
+        await self.db.close()
+
+    def register_board(self, board_id, guild_id, channel_id, message_id):
+        board = self.boards.get(board_id)
+        if board is None:
+            board = self.boards[board_id] = Board(self, board_id, guild_id, channel_id, message_id)
+        board.guild_id = guild_id
+        self.board_by_channel[channel_id] = board_id
+        if message_id:
+            self.board_by_message[message_id] = board_id
+        return board
+
+    async def board_for(self, interaction: discord.Interaction):
+        # 先用面板訊息找，找不到再用頻道找
+        board_id = self.board_by_message.get(interaction.message.id) if interaction.message else None
+        if board_id is None:
+            board_id = self.board_by_channel.get(interaction.channel_id)
+        board = self.boards.get(board_id)
+        if board:
+            await board.ensure_loaded()
+        return board
+
+    async def migrate_legacy_file(self):
+        # 舊版 team_todo_list.json 只搬一次，搬完改名保留備份
+        if not os.path.exists(DATA_FILE) or TODO_CHANNEL_ID in self.board_by_channel:
+            return
+        try:
+            with open(DATA_FILE, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception as e:
+            print(f"❌ 讀取舊版待辦清單失敗: {e}")
+            return
+
+        board_id, guild_id, channel_id, _ = await self.db.create_board(None, TODO_CHANNEL_ID)
+        rows = []
+        def collect(items, parent_id):
+            for item in items:
+                task_id = item.get("id") or new_id()
+                rows.append((task_id, board_id, parent_id, len(rows), item.get("task", ""), item.get("status", "TODO"), item.get("owner"), int(item.get("expanded", False))))
+                collect(item.get("children", []), task_id)
+        collect(data.get("shared", []), None)
+
+        await self.db.write_tasks(board_id, rows, [])
+        if data.get("msg_id"):
+            await self.db.set_message(board_id, data["msg_id"])
+        self.register_board(board_id, guild_id, channel_id, data.get("msg_id"))
+        os.replace(DATA_FILE, f"{DATA_FILE}.migrated")
+        print(f"✅ [待辦] 已把 {DATA_FILE} 的 {len(rows)} 筆任務搬進 {DB_FILE}")
 
     @commands.command()
+    @commands.guild_only()
+    @commands.has_permissions(manage_channels=True)
     async def init_todo(self, ctx):
-        if ctx.channel.id != TODO_CHANNEL_ID: return
-        await ctx.message.delete()
-        await self.update_dashboard()
+        """在目前頻道建立 (或重新貼出) 待辦面板"""
+        board = self.register_board(*await self.db.create_board(ctx.guild.id, ctx.channel.id))
+        await board.ensure_loaded()
+        await board.update_dashboard(force=True)
+        # 收掉指令訊息只是順手，沒有「管理訊息」權限就算了，面板照樣要貼出來
+        try:
+            await ctx.message.delete()
+        except discord.HTTPException:
+            pass
 
 async def setup(bot):
-    await bot.add_cog(Todo(bot))
\ No newline at end of file
+    await bot.add_cog(Todo(bot))
@@ -1,8 +1,41 @@
 # 檔案：cogs/video_scraping.py
 import discord
 from discord.ext import commands, tasks
+from aiohttp import web
 import feedparser
-import aiohttp # 👈 新增這個用來檢查網址
+import asyncio
+import json
+import os
+import time
+import calendar
+import random
+import statistics
+import hmac
+import secrets
+import urllib.parse
+
+FEED_CONCURRENCY = 4 # 同時最多抓幾個頻道的 RSS
+# 📦 每個頻道已經看過 (通知過) 的影片 id，重開機也記得
+STATE_FILE = "youtube_state.json"
+SEEN_LIMIT = 50 # 每個頻道只留最近 50 支 (RSS 一次最多 15 支，綽綽有餘)
+# 🩳 Shorts 判斷結果也存起來，同一支影片不用再問 YouTube 第二次
+SHORTS_CACHE_LIMIT = 1000
+SHORTS_CONCURRENCY = 4
+MAX_DEFER = 3 # 判斷失敗先不發，下次再試；連續失敗這麼多次就當長影片發出去
+# ⏱️ 每個頻道自己的檢查間隔：看它平常多久發一支片，大約每個「發片間隔」檢查 96 次
+MIN_POLL = 5 * 60
+MAX_POLL = 3 * 60 * 60
+POLLS_PER_UPLOAD = 96
+POLL_JITTER = 0.15 # 間隔上下隨機 15%，各頻道錯開不要擠在同一分鐘
+# 📡 WebSub：有新片時 YouTube 直接推過來，秒級通知；要有對外網址才能用，沒設定就只靠輪詢
+# WEBSUB_CALLBACK_URL 填 WebServer 上 WEBSUB_PATH 的公開網址，例如 https://你的網域/websub/youtube
+WEBSUB_CALLBACK_URL = os.getenv("WEBSUB_CALLBACK_URL")
+WEBSUB_HUB_URL = os.getenv("WEBSUB_HUB_URL", "https://pubsubhubbub.appspot.com/subscribe")
+WEBSUB_PATH = "/websub/youtube"
+WEBSUB_TOPIC = "https://www.youtube.com/xml/feeds/videos.xml?channel_id={}"
+WEBSUB_LEASE = 5 * 24 * 60 * 60 # 每次訂閱 5 天
+WEBSUB_RENEW_BEFORE = 24 * 60 * 60 # 到期前一天就續訂
+PUSH_MAX_AGE = 2 * 24 * 60 * 60 # 舊片改標題也會被推播，只收兩天內發布的
 
 class VideoScraping(commands.Cog):
     def __init__(self, bot):
@@ -34,30 +67,177 @@ class VideoScraping(commands.Cog):
             
         }
         
-        # 記錄上次影片 ID
-        self.latest_video_ids = {}
+        # 每個頻道看過的影片 id (舊 -> 新)，存在 STATE_FILE
+        self.seen_videos = {}
+        self.shorts_cache = {} # video_id -> 是不是 Shorts (越後面越新)
+        self.shorts_hits = 0 # 直接用快取的次數
+        self.shorts_checks = 0 # 真的去問 YouTube 的次數
+        self.deferred = {} # video_id -> 判斷失敗幾次了
+        self.shorts_semaphore = asyncio.Semaphore(SHORTS_CONCURRENCY)
+        self.state_lock = asyncio.Lock()
+        # 每個 RSS 上次回傳的 ETag / Last-Modified：沒更新時 YouTube 只回 304，不用再下載整份 XML
+        self.feed_validators = {}
+        self.feed_semaphore = asyncio.Semaphore(FEED_CONCURRENCY)
+        # 每個頻道下次檢查的時間 / 學到的間隔；剛啟動時把第一輪打散在兩分鐘內
+        now = time.monotonic()
+        self.next_poll = {channel_id: now + random.uniform(0, 120) for channel_id in self.youtube_channels.values()}
+        self.poll_intervals = {}
+        # WebSub 訂閱狀態：有有效訂閱的頻道改成很久才輪詢一次當備援
+        self.websub_secret = os.getenv("WEBSUB_SECRET") or secrets.token_hex(16)
+        self.websub_mounted = False
+        self.leases = {} # channel_id -> 訂閱到期時間
+        self.pending_subs = {} # channel_id -> 送出訂閱的時間 (等 hub 來驗證)
+        self.process_lock = asyncio.Lock() # 輪詢跟推播同時進來時，一次只處理一批，不會重複通知
 
         # 啟動檢查排程
         self.check_youtube_task.start()
+        self.websub_task.start()
+
+    async def cog_load(self):
+        if os.path.exists(STATE_FILE):
+            try:
+                with open(STATE_FILE, "r", encoding="utf-8") as f:
+                    state = json.load(f)
+                self.seen_videos = state.get("seen", {})
+                self.shorts_cache = state.get("shorts", {})
+            except Exception as e:
+                print(f"⚠️ [YouTube] 讀取 {STATE_FILE} 失敗，當作第一次啟動: {e}")
+        self.mount_websub()
 
     def cog_unload(self):
         self.check_youtube_task.cancel()
+        self.websub_task.cancel()
+
+    def write_state(self, data):
+        # 先寫暫存檔再換名，寫到一半當機也不會留下壞掉的 JSON
+        temp_file = f"{STATE_FILE}.tmp"
+        with open(temp_file, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(temp_file, STATE_FILE)
+
+    async def save_state(self):
+        async with self.state_lock:
+            data = {
+                "seen": {channel_id: list(ids) for channel_id, ids in self.seen_videos.items()},
+                "shorts": dict(self.shorts_cache)
+            }
+            await asyncio.to_thread(self.write_state, data)
+
+    def unseen_entries(self, channel_id, entries):
+        """比對整份 RSS，回傳還沒通知過的影片 (依發布時間由舊到新)；第一次看到的頻道只記錄不通知"""
+        # RSS 是新的在前面，反過來再依發布時間排 (排序是穩定的，沒有時間的照原順序)
+        entries = sorted(reversed(entries), key=lambda e: e.get("published_parsed") or time.gmtime(0))
+        seen = self.seen_videos.get(channel_id)
+        if seen is None:
+            self.seen_videos[channel_id] = [entry.yt_videoid for entry in entries][-SEEN_LIMIT:]
+            return []
+
+        seen_set = set(seen)
+        return [entry for entry in entries if entry.yt_videoid not in seen_set]
 
-    # 👇 新增：判斷是否為 Shorts 的功能
+    def mark_seen(self, channel_id, video_id):
+        seen = self.seen_videos[channel_id]
+        seen.append(video_id)
+        del seen[:-SEEN_LIMIT]
+        self.deferred.pop(video_id, None)
+
+    async def announce(self, name, entry, is_shorts, video_channel, shorts_channel):
+        video_id = entry.yt_videoid
+        print(f"🔍 發現新片: {entry.title}")
+
+        if is_shorts:
+            if shorts_channel:
+                print(f"👉 判定為 Shorts，發送到 Shorts 頻道")
+                # 為了讓 Discord 預覽正常顯示 Shorts，連結可以用 shorts 格式或原本的
+                await shorts_channel.send(f"📱 **{name}** 發布新 Shorts 了！\nhttps://www.youtube.com/shorts/{video_id}")
+        else:
+            if video_channel:
+                print(f"👉 判定為長影片，發送到 Video 頻道")
+                await video_channel.send(f"📢 **{name}** 發布新影片了！\n{entry.link}")
+
+    # 👇 判斷是否為 Shorts：True / False，問不到 (網路錯誤、被限流) 回傳 None
     async def check_is_shorts(self, video_id):
         url = f"https://www.youtube.com/shorts/{video_id}"
         try:
             # 禁止自動重新導向 (allow_redirects=False)
             # 如果是 Shorts，會回傳 200
             # 如果是長影片，YouTube 會回傳 303 並試圖導向 /watch
-            async with aiohttp.ClientSession() as session:
-                async with session.head(url, allow_redirects=False) as response:
-                    return response.status == 200
-        except:
-            return False # 發生錯誤預設視為長影片
-
-    # --- 排程：每 10 分鐘檢查一次 YouTube ---
-    @tasks.loop(minutes=10)
+            async with self.shorts_semaphore:
+                response = await self.bot.get_cog("HttpClient").request("HEAD", url, retries=3, allow_redirects=False)
+        except Exception as e:
+            print(f"⚠️ [YouTube] 判斷 {video_id} 失敗: {e}")
+            return None
+        if response.status == 200:
+            return True
+        if 300 <= response.status < 400:
+            return False
+        print(f"⚠️ [YouTube] 判斷 {video_id} 得到非預期代碼: {response.status}")
+        return None
+
+    async def classify(self, video_ids):
+        """一次判斷多支影片，先查快取，剩下的同時去問 YouTube；回傳 {video_id: True/False/None}"""
+        verdicts = {}
+        missing = []
+        for video_id in video_ids:
+            if video_id in self.shorts_cache:
+                verdicts[video_id] = self.shorts_cache[video_id]
+                self.shorts_hits += 1
+            else:
+                missing.append(video_id)
+
+        results = await asyncio.gather(*(self.check_is_shorts(video_id) for video_id in missing))
+        self.shorts_checks += len(missing)
+        for video_id, is_shorts in zip(missing, results):
+            verdicts[video_id] = is_shorts
+            if is_shorts is not None:
+                self.shorts_cache[video_id] = is_shorts
+        # 只留最新的 SHORTS_CACHE_LIMIT 筆 (dict 照加入順序)
+        for video_id in list(self.shorts_cache)[:-SHORTS_CACHE_LIMIT]:
+            del self.shorts_cache[video_id]
+        return verdicts
+
+    async def fetch_feed(self, channel_id):
+        """抓一個頻道的 RSS，沒有更新 (304) 或失敗時回傳 None"""
+        url = f"https://www.youtube.com/feeds/videos.xml?channel_id={channel_id}"
+        headers = {}
+        etag, last_modified = self.feed_validators.get(channel_id, (None, None))
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+
+        async with self.feed_semaphore:
+            response = await self.bot.get_cog("HttpClient").request("GET", url, headers=headers)
+        if response.status == 304:
+            return None
+        if response.status != 200:
+            print(f"⚠️ [YouTube] {channel_id} RSS 回傳錯誤代碼: {response.status}")
+            return None
+
+        self.feed_validators[channel_id] = (response.headers.get("ETag"), response.headers.get("Last-Modified"))
+        # feedparser 是同步的，丟到背景執行緒解析
+        return await asyncio.to_thread(feedparser.parse, response.body)
+
+    def learn_interval(self, feed):
+        """從 RSS 裡的發布時間估計這個頻道多久該檢查一次"""
+        times = sorted(calendar.timegm(e.published_parsed) for e in feed.entries if e.get("published_parsed"))
+        if len(times) < 2:
+            return MAX_POLL
+        typical_gap = statistics.median(b - a for a, b in zip(times, times[1:]))
+        # 最近一支已經比平常間隔久很多 = 頻道進入休眠，跟著放慢
+        typical_gap = max(typical_gap, (time.time() - times[-1]) / 2)
+        return min(max(typical_gap / POLLS_PER_UPLOAD, MIN_POLL), MAX_POLL)
+
+    def schedule(self, channel_id, interval=None):
+        if interval is None:
+            interval = self.poll_intervals.get(channel_id, MIN_POLL)
+            # 有 WebSub 推播的頻道只需要偶爾輪詢當保險
+            if self.leases.get(channel_id, 0) > time.time():
+                interval = MAX_POLL
+        self.next_poll[channel_id] = time.monotonic() + interval * random.uniform(1 - POLL_JITTER, 1 + POLL_JITTER)
+
+    # --- 排程：每分鐘看一次哪些頻道到期了，只檢查到期的 ---
+    @tasks.loop(minutes=1)
     async def check_youtube_task(self):
         # 取得兩個目標頻道
         video_channel = self.bot.get_channel(self.video_channel_id)
@@ -68,41 +248,227 @@ class VideoScraping(commands.Cog):
             print(f"❌ 錯誤：找不到頻道 ID，請檢查 video_channel_id 或 shorts_channel_id")
             # 這裡不 return，避免其中一個頻道錯了就全部不跑
         
-        for name, channel_id in self.youtube_channels.items():
-            url = f"https://www.youtube.com/feeds/videos.xml?channel_id={channel_id}"
-            
-            # 解析 RSS (feedparser 是同步的，量少時沒問題)
-            feed = feedparser.parse(url)
-
-            if feed.entries:
-                latest_video = feed.entries[0]
-                video_id = latest_video.yt_videoid
-                video_link = latest_video.link
-                video_title = latest_video.title
-
-                # 邏輯 1. 剛開機 -> 記住最新影片，不發通知
-                if channel_id not in self.latest_video_ids:
-                    self.latest_video_ids[channel_id] = video_id
-                
-                # 邏輯 2. 有紀錄且 ID 不同 -> 發通知
-                elif self.latest_video_ids[channel_id] != video_id:
-                    print(f"🔍 發現新片: {video_title}，正在判斷類型...")
-                    
-                    # 判斷是 Shorts 還是長影片
-                    is_shorts = await self.check_is_shorts(video_id)
-                    
-                    if is_shorts:
-                        if shorts_channel:
-                            print(f"👉 判定為 Shorts，發送到 Shorts 頻道")
-                            # 為了讓 Discord 預覽正常顯示 Shorts，連結可以用 shorts 格式或原本的
-                            await shorts_channel.send(f"📱 **{name}** 發布新 Shorts 了！\nhttps://www.youtube.com/shorts/{video_id}")
-                    else:
-                        if video_channel:
-                            print(f"👉 判定為長影片，發送到 Video 頻道")
-                            await video_channel.send(f"📢 **{name}** 發布新影片了！\n{video_link}")
-
-                    # 更新紀錄
-                    self.latest_video_ids[channel_id] = video_id
+        # 到期的頻道同時抓 (有上限)，再依序處理
+        now = time.monotonic()
+        channels = [
+            (name, channel_id) for name, channel_id in self.youtube_channels.items()
+            if self.next_poll.get(channel_id, 0) <= now
+        ]
+        if not channels:
+            return
+        for _, channel_id in channels:
+            self.schedule(channel_id)
+        feeds = await asyncio.gather(
+            *(self.fetch_feed(channel_id) for _, channel_id in channels), return_exceptions=True
+        )
+
+        batches = []
+        for (name, channel_id), feed in zip(channels, feeds):
+            if isinstance(feed, Exception):
+                print(f"❌ [YouTube] 抓取 {name} 失敗: {feed}")
+                continue
+
+            if not feed or not feed.entries:
+                continue
+
+            # 有拿到新的 RSS 就重新估一次間隔 (304 沿用舊的)
+            self.poll_intervals[channel_id] = self.learn_interval(feed)
+            self.schedule(channel_id)
+            batches.append((name, channel_id, feed.entries))
+
+        try:
+            await self.process_entries(batches)
+        except Exception as e:
+            # 例外跑出去的話 tasks.loop 會直接停掉，之後就再也不檢查了
+            print(f"❌ [YouTube] 處理新影片失敗: {e}")
+
+    async def process_entries(self, batches):
+        """batches: [(頻道名稱, channel_id, RSS 影片們)]；找出沒通知過的，判斷 Shorts 後照順序發出去"""
+        video_channel = self.bot.get_channel(self.video_channel_id)
+        shorts_channel = self.bot.get_channel(self.shorts_channel_id)
+
+        async with self.process_lock:
+            changed = False
+            new_videos = [] # (頻道名稱, channel_id, 還沒通知的影片們)
+            for name, channel_id, entries in batches:
+                # 邏輯：整份 RSS 跟看過的清單比對，兩次檢查之間發了好幾支也會一支一支照順序通知
+                first_time = channel_id not in self.seen_videos
+                unseen = self.unseen_entries(channel_id, entries)
+                changed = changed or first_time
+                if unseen:
+                    new_videos.append((name, channel_id, unseen))
+
+            # 所有新影片一起判斷 Shorts (同時進行)
+            verdicts = await self.classify([entry.yt_videoid for _, _, unseen in new_videos for entry in unseen])
+
+            try:
+                for name, channel_id, unseen in new_videos:
+                    for entry in unseen:
+                        video_id = entry.yt_videoid
+                        is_shorts = verdicts[video_id]
+                        if is_shorts is None:
+                            self.deferred[video_id] = self.deferred.get(video_id, 0) + 1
+                            if self.deferred[video_id] < MAX_DEFER:
+                                # 判斷不出來就先不發 (後面的也等它，保持順序)；清掉 ETag 讓下次一定重抓這個頻道
+                                print(f"⏸️ [YouTube] {video_id} 暫時無法判斷類型，下次再試")
+                                self.feed_validators.pop(channel_id, None)
+                                self.schedule(channel_id, MIN_POLL)
+                                break
+                            is_shorts = False
+                        try:
+                            await self.announce(name, entry, is_shorts, video_channel, shorts_channel)
+                        except Exception as e:
+                            # 發不出去 (沒權限、Discord 出錯) 也算一次重試，太多次就放棄這支，免得整個頻道卡住
+                            self.deferred[video_id] = self.deferred.get(video_id, 0) + 1
+                            if self.deferred[video_id] < MAX_DEFER:
+                                print(f"❌ [YouTube] {video_id} 通知失敗，下次再試: {e}")
+                                self.feed_validators.pop(channel_id, None)
+                                self.schedule(channel_id, MIN_POLL)
+                                break
+                            print(f"❌ [YouTube] {video_id} 一直通知失敗，放棄: {e}")
+                        self.mark_seen(channel_id, video_id)
+                        changed = True
+            finally:
+                # 已經發出去的一定要記下來，不然重開機又會再發一次
+                if changed:
+                    await self.save_state()
+
+    # --- 📡 WebSub 推播 ---
+    def mount_websub(self):
+        # 路徑要在 WebServer 開門 (on_ready) 之前掛上去；cog 載入順序不一定，所以 cog_load 跟 on_ready 都試一次
+        if not WEBSUB_CALLBACK_URL or self.websub_mounted:
+            return
+        web_cog = self.bot.get_cog('WebServer')
+        if not web_cog or web_cog.is_running:
+            return
+        web_cog.add_route('GET', WEBSUB_PATH, self.handle_websub_verify)
+        web_cog.add_route('POST', WEBSUB_PATH, self.handle_websub_notify)
+        self.websub_mounted = True
+        print(f"✅ [YouTube] WebSub {WEBSUB_PATH} 已掛載")
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        self.mount_websub()
+
+    async def subscribe(self, channel_id):
+        self.pending_subs[channel_id] = time.time()
+        data = {
+            "hub.callback": WEBSUB_CALLBACK_URL,
+            "hub.mode": "subscribe",
+            "hub.topic": WEBSUB_TOPIC.format(channel_id),
+            "hub.lease_seconds": str(WEBSUB_LEASE),
+            "hub.secret": self.websub_secret,
+            "hub.verify": "async"
+        }
+        try:
+            response = await self.bot.get_cog("HttpClient").request("POST", WEBSUB_HUB_URL, data=data)
+        except Exception as e:
+            print(f"⚠️ [YouTube] WebSub 訂閱 {channel_id} 失敗: {e}")
+            return
+        if response.status not in (202, 204):
+            print(f"⚠️ [YouTube] WebSub 訂閱 {channel_id} 被 hub 拒絕: {response.status}")
+
+    # --- 排程：每 30 分鐘檢查訂閱，快到期就續訂，已經過期的改回一般輪詢 ---
+    @tasks.loop(minutes=30)
+    async def websub_task(self):
+        if not self.websub_mounted:
+            return
+        now = time.time()
+        renew = []
+        for channel_id in self.youtube_channels.values():
+            expires = self.leases.get(channel_id)
+            if expires and expires <= now:
+                print(f"⚠️ [YouTube] {channel_id} 的 WebSub 訂閱已過期，先改回輪詢")
+                del self.leases[channel_id]
+                self.schedule(channel_id)
+            if expires and expires - now > WEBSUB_RENEW_BEFORE:
+                continue
+            # 剛送出還在等 hub 驗證的就不要重送
+            if now - self.pending_subs.get(channel_id, 0) < 10 * 60:
+                continue
+            renew.append(channel_id)
+        await asyncio.gather(*(self.subscribe(channel_id) for channel_id in renew))
+
+    @websub_task.before_loop
+    async def before_websub_task(self):
+        await self.bot.wait_until_ready()
+        await asyncio.sleep(10) # 等 WebServer 開門，hub 才連得到我們
+
+    async def handle_websub_verify(self, request):
+        # hub 來確認「這個訂閱真的是你要的嗎」：是的話把 challenge 原樣回傳
+        mode = request.query.get("hub.mode")
+        topic = request.query.get("hub.topic", "")
+        challenge = request.query.get("hub.challenge")
+        channel_id = urllib.parse.parse_qs(urllib.parse.urlparse(topic).query).get("channel_id", [None])[0]
+
+        if mode == "subscribe" and challenge and self.pending_subs.pop(channel_id, None):
+            lease = int(request.query.get("hub.lease_seconds", WEBSUB_LEASE))
+            self.leases[channel_id] = time.time() + lease
+            self.schedule(channel_id)
+            print(f"📡 [YouTube] {channel_id} WebSub 訂閱成功 ({lease // 3600} 小時)")
+            return web.Response(text=challenge)
+        if mode == "denied":
+            print(f"⚠️ [YouTube] hub 拒絕了 {channel_id} 的訂閱: {request.query.get('hub.reason')}")
+            self.pending_subs.pop(channel_id, None)
+            return web.Response(text="")
+        # 不是我們送出的訂閱 (或有人想幫我們退訂) 一律不認
+        return web.Response(status=404)
+
+    def verify_signature(self, body, signature):
+        # X-Hub-Signature: sha1=<hex>，用訂閱時給 hub 的 secret 算 HMAC 比對
+        algorithm, _, digest = signature.partition("=")
+        if algorithm not in ("sha1", "sha256", "sha384", "sha512"):
+            return False
+        expected = hmac.new(self.websub_secret.encode(), body, algorithm).hexdigest()
+        return hmac.compare_digest(expected, digest)
+
+    async def handle_websub_notify(self, request):
+        body = await request.read()
+        # 簽章不對就當沒收到 (照規範還是回 2xx，hub 才不會一直重送)
+        if not self.verify_signature(body, request.headers.get("X-Hub-Signature", "")):
+            print("⚠️ [YouTube] WebSub 通知簽章不符，已忽略")
+            return web.Response(status=202)
+        # 先回應 hub，處理 (判斷 Shorts、發通知) 放到背景
+        asyncio.create_task(self.handle_push(body))
+        return web.Response(status=202)
+
+    async def handle_push(self, body):
+        try:
+            feed = await asyncio.to_thread(feedparser.parse, body)
+            names = {channel_id: name for name, channel_id in self.youtube_channels.items()}
+            cutoff = time.time() - PUSH_MAX_AGE
+            entries_by_channel = {}
+            for entry in feed.entries:
+                channel_id = entry.get("yt_channelid")
+                published = entry.get("published_parsed")
+                # 只處理已經輪詢過 (有看過清單) 的頻道、而且是最近發布的影片
+                if channel_id not in names or channel_id not in self.seen_videos:
+                    continue
+                if not published or calendar.timegm(published) < cutoff:
+                    continue
+                entries_by_channel.setdefault(channel_id, []).append(entry)
+
+            batches = [(names[channel_id], channel_id, entries) for channel_id, entries in entries_by_channel.items()]
+            if batches:
+                await self.process_entries(batches)
+        except Exception as e:
+            print(f"❌ [YouTube] 處理 WebSub 通知失敗: {e}")
+
+    @commands.command()
+    async def yt_stats(self, ctx):
+        """查看 Shorts 判斷快取的使用狀況"""
+        total = self.shorts_hits + self.shorts_checks
+        ratio = self.shorts_hits / total * 100 if total else 0
+        await ctx.send(
+            f"🩳 Shorts 判斷：快取命中 {self.shorts_hits} 次 / 實際查詢 {self.shorts_checks} 次 (命中率 {ratio:.1f}%)\n"
+            f"📦 快取 {len(self.shorts_cache)} 支，⏸️ 等待重試 {len(self.deferred)} 支"
+        )
+        if self.poll_intervals:
+            lines = [
+                f"• {name}：每 {self.poll_intervals[channel_id] / 60:.0f} 分鐘"
+                for name, channel_id in self.youtube_channels.items() if channel_id in self.poll_intervals
+            ]
+            await ctx.send("⏱️ 目前檢查間隔\n" + "\n".join(lines))
 
     @check_youtube_task.before_loop
     async def before_youtube_task(self):
@@ -2,78 +2,201 @@ import discord
 from discord.ext import commands, tasks
 import datetime
 import urllib.parse
-import aiohttp # 👈 改用這個
-import asyncio # 👈 用來休息緩衝
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict
+
+# 📦 每日預報的訂閱清單 (哪個頻道要收哪個地點)
+SUBSCRIPTION_FILE = "weather_subscriptions.json"
+MAX_BATCH = 100 # Open-Meteo 一次最多帶幾組座標
+# 第一次啟動 (還沒有訂閱檔) 時預設的訂閱
+DEFAULT_SUBSCRIPTIONS = [
+    {
+        "name": "台北市", 
+        "lat": 25.0330, 
+        "lon": 121.5654, 
+        "channel_id": 1463412543128211641
+    },
+    {
+        "name": "新北市", 
+        "lat": 25.0143, 
+        "lon": 121.4672, 
+        "channel_id": 1463412543128211641
+    },
+]
+
+# 🗺️ 地名 -> 座標 幾乎不會變，查過就存檔 (LRU，最多 GEOCODE_LIMIT 筆)
+GEOCODE_FILE = "weather_geocode.json"
+GEOCODE_LIMIT = 500
+
+def coord_key(lat, lon):
+    # 同一個地點 (差不到 1 公里) 的訂閱只查一次
+    return (round(lat, 2), round(lon, 2))
+
+def next_model_update():
+    # Open-Meteo 的預報每小時整點更新，快取就用到下一個整點
+    return (time.time() // 3600 + 1) * 3600
 
 class Weather(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         
-        # 👇 地點清單
-        self.daily_locations = [
-            {
-                "name": "台北市", 
-                "lat": 25.0330, 
-                "lon": 121.5654, 
-                "channel_id": 1463412543128211641
-            },
-            {
-                "name": "新北市", 
-                "lat": 25.0143, 
-                "lon": 121.4672, 
-                "channel_id": 1463412543128211641
-            },
-        ]
+        # 👇 訂閱清單：[{name, lat, lon, channel_id}]，存在 SUBSCRIPTION_FILE
+        self.subscriptions = []
+        self.save_lock = asyncio.Lock()
+        # 快取：地名 -> (lat, lon, 正式名稱)；座標 -> (到期時間, 天氣資料)
+        self.geocode_cache = OrderedDict()
+        self.forecast_cache = {}
+        self.stats = {"geocode_hits": 0, "geocode_misses": 0, "forecast_hits": 0, "forecast_misses": 0}
 
         # 啟動排程
         self.daily_forecast_task.start()
 
+    async def cog_load(self):
+        if os.path.exists(GEOCODE_FILE):
+            try:
+                with open(GEOCODE_FILE, "r", encoding="utf-8") as f:
+                    self.geocode_cache = OrderedDict((name, tuple(value)) for name, value in json.load(f))
+            except Exception as e:
+                print(f"⚠️ [天氣] 讀取 {GEOCODE_FILE} 失敗: {e}")
+
+        if os.path.exists(SUBSCRIPTION_FILE):
+            try:
+                with open(SUBSCRIPTION_FILE, "r", encoding="utf-8") as f:
+                    self.subscriptions = json.load(f)
+                return
+            except Exception as e:
+                print(f"⚠️ [天氣] 讀取 {SUBSCRIPTION_FILE} 失敗，改用預設訂閱: {e}")
+        self.subscriptions = [dict(sub) for sub in DEFAULT_SUBSCRIPTIONS]
+
     def cog_unload(self):
         self.daily_forecast_task.cancel()
 
+    def write_json(self, path, data):
+        # 先寫暫存檔再換名，寫到一半當機也不會留下壞掉的 JSON
+        temp_file = f"{path}.tmp"
+        with open(temp_file, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(temp_file, path)
+
+    async def save_subscriptions(self):
+        async with self.save_lock:
+            await asyncio.to_thread(self.write_json, SUBSCRIPTION_FILE, [dict(sub) for sub in self.subscriptions])
+
+    async def save_geocode(self):
+        async with self.save_lock:
+            await asyncio.to_thread(self.write_json, GEOCODE_FILE, [[name, list(value)] for name, value in self.geocode_cache.items()])
+
     # --- 小幫手 1: 取得經緯度 (改為非同步) ---
     async def get_coords(self, city_name):
+        key = " ".join(city_name.lower().split())
+        cached = self.geocode_cache.get(key)
+        if cached:
+            self.geocode_cache.move_to_end(key)
+            self.stats["geocode_hits"] += 1
+            return cached
+        self.stats["geocode_misses"] += 1
+
+        lat, lon, name = await self.fetch_coords(city_name)
+        if lat is not None:
+            # 查不到的不存，說不定只是 API 暫時出錯
+            self.geocode_cache[key] = (lat, lon, name)
+            while len(self.geocode_cache) > GEOCODE_LIMIT:
+                self.geocode_cache.popitem(last=False)
+            await self.save_geocode()
+        return lat, lon, name
+
+    async def fetch_coords(self, city_name):
         try:
             encoded_name = urllib.parse.quote(city_name)
             url = f"https://geocoding-api.open-meteo.com/v1/search?name={encoded_name}&count=1&language=zh&format=json"
             
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        if "results" in data and len(data["results"]) > 0:
-                            result = data["results"][0]
-                            return result["latitude"], result["longitude"], result["name"]
+            # 透過共用連線池發送
+            data = await self.bot.get_cog("HttpClient").get_json(url)
+            if data and "results" in data and len(data["results"]) > 0:
+                result = data["results"][0]
+                return result["latitude"], result["longitude"], result["name"]
             return None, None, None
         except Exception as e:
             print(f"❌ 找地點失敗: {e}")
             return None, None, None
 
-    # --- 小幫手 2: 取得天氣資料 (改為非同步) ---
-    async def get_weather_data(self, lat, lon):
+    # --- 小幫手 2: 取得天氣資料 (一次查多個地點) ---
+    async def get_weather_batch(self, coords):
+        """coords: [(lat, lon)]，回傳同樣順序的天氣資料 (查不到的是 None)；還沒過期的直接用快取"""
+        now = time.time()
+        results = [None] * len(coords)
+        missing = [] # 快取沒有的：(在 coords 裡的位置, 座標)
+        for i, (lat, lon) in enumerate(coords):
+            cached = self.forecast_cache.get(coord_key(lat, lon))
+            if cached and cached[0] > now:
+                results[i] = cached[1]
+                self.stats["forecast_hits"] += 1
+            else:
+                missing.append((i, (lat, lon)))
+        self.stats["forecast_misses"] += len(missing)
+        if not missing:
+            return results
+
+        fetched = await self.fetch_weather_batch([coord for _, coord in missing])
+        expires = next_model_update()
+        for (i, (lat, lon)), data in zip(missing, fetched):
+            results[i] = data
+            if data:
+                self.forecast_cache[coord_key(lat, lon)] = (expires, data)
+        # 順手清掉過期的
+        for key in [key for key, (expiry, _) in self.forecast_cache.items() if expiry <= now]:
+            del self.forecast_cache[key]
+        return results
+
+    async def fetch_weather_batch(self, coords):
+        results = []
+        for start in range(0, len(coords), MAX_BATCH):
+            chunk = coords[start:start + MAX_BATCH]
+            try:
+                # Open-Meteo 接受逗號分隔的多組經緯度，一次請求拿回全部
+                latitudes = ",".join(str(lat) for lat, _ in chunk)
+                longitudes = ",".join(str(lon) for _, lon in chunk)
+                url = f"https://api.open-meteo.com/v1/forecast?latitude={latitudes}&longitude={longitudes}&daily=weathercode,temperature_2m_max,temperature_2m_min,precipitation_probability_max&timezone=auto"
+
+                data = await self.bot.get_cog("HttpClient").get_json(url)
+                # 只有一個地點時回傳的是物件，多個地點才是陣列
+                if isinstance(data, dict):
+                    data = [data]
+                chunk_results = [self.safe_parse_daily(item) for item in data or []]
+            except Exception as e:
+                print(f"❌ 氣象抓取錯誤: {e}")
+                chunk_results = []
+            # 筆數對不上就不知道誰是誰，整批當失敗，結果才會跟 coords 一一對應
+            if len(chunk_results) != len(chunk):
+                chunk_results = [None] * len(chunk)
+            results.extend(chunk_results)
+        return results
+
+    def safe_parse_daily(self, data):
+        # 單一地點的資料壞掉只影響那一個，不拖累同一批的其他地點
         try:
-            url = f"https://api.open-meteo.com/v1/forecast?latitude={lat}&longitude={lon}&daily=weathercode,temperature_2m_max,temperature_2m_min,precipitation_probability_max&timezone=auto"
-            
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url) as response:
-                    if response.status != 200:
-                        print(f"⚠️ API 回傳錯誤代碼: {response.status}")
-                        return None
-                    
-                    data = await response.json()
-                    daily = data.get("daily", {})
-                    if not daily: return None
-
-                    return {
-                        "max": daily["temperature_2m_max"][0],
-                        "min": daily["temperature_2m_min"][0],
-                        "rain": daily["precipitation_probability_max"][0],
-                        "status": self.weather_code_to_text(daily["weathercode"][0])
-                    }
+            return self.parse_daily(data)
         except Exception as e:
-            print(f"❌ 氣象抓取錯誤: {e}")
+            print(f"❌ 氣象資料解析錯誤: {e}")
             return None
 
+    def parse_daily(self, data):
+        daily = data.get("daily", {})
+        if not daily: return None
+
+        return {
+            "max": daily["temperature_2m_max"][0],
+            "min": daily["temperature_2m_min"][0],
+            "rain": daily["precipitation_probability_max"][0],
+            "status": self.weather_code_to_text(daily["weathercode"][0])
+        }
+
+    async def get_weather_data(self, lat, lon):
+        return (await self.get_weather_batch([(lat, lon)]))[0]
+
     # --- 小幫手 3: 天氣代碼轉文字 ---
     def weather_code_to_text(self, code):
         if code == 0: return "☀️ 晴朗"
@@ -91,7 +214,9 @@ class Weather(commands.Cog):
     @commands.command()
     async def weather(self, ctx, *, city: str = None):
         if not city:
-            loc = self.daily_locations[0]
+            # 沒指定就用這個頻道訂閱的第一個地點，再沒有就用預設
+            subs = [sub for sub in self.subscriptions if sub["channel_id"] == ctx.channel.id]
+            loc = subs[0] if subs else DEFAULT_SUBSCRIPTIONS[0]
             city, lat, lon = loc["name"], loc["lat"], loc["lon"]
         else:
             await ctx.send(f"🔍 正在搜尋「{city}」的天氣...")
@@ -114,14 +239,74 @@ class Weather(commands.Cog):
         else:
             await ctx.send("❌ 無法取得天氣資料，請稍後再試。")
 
+    @commands.command()
+    async def weather_stats(self, ctx):
+        """查看地名 / 天氣快取的命中率"""
+        lines = []
+        for label, kind, size in (("🗺️ 地名", "geocode", len(self.geocode_cache)), ("🌦️ 預報", "forecast", len(self.forecast_cache))):
+            hits, misses = self.stats[f"{kind}_hits"], self.stats[f"{kind}_misses"]
+            ratio = hits / (hits + misses) * 100 if hits + misses else 0
+            lines.append(f"{label}：命中 {hits} / 未命中 {misses} (命中率 {ratio:.1f}%)，快取 {size} 筆")
+        await ctx.send("\n".join(lines))
+
     # ===============================
-    #  功能 2: 每天定時自動預報
+    #  功能 2: 訂閱每日預報 (以頻道為單位)
+    # ===============================
+    @commands.command()
+    async def weather_sub(self, ctx, *, city: str):
+        lat, lon, real_name = await self.get_coords(city)
+        if not lat:
+            await ctx.send(f"❌ 找不到「{city}」這個地方。")
+            return
+        for sub in self.subscriptions:
+            if sub["channel_id"] == ctx.channel.id and coord_key(sub["lat"], sub["lon"]) == coord_key(lat, lon):
+                await ctx.send(f"ℹ️ 這個頻道已經訂閱 **{sub['name']}** 了")
+                return
+
+        self.subscriptions.append({"name": real_name, "lat": lat, "lon": lon, "channel_id": ctx.channel.id})
+        await self.save_subscriptions()
+        await ctx.send(f"✅ 已訂閱 **{real_name}**，每天早上 6 點會在這裡播報")
+
+    @commands.command()
+    async def weather_unsub(self, ctx, *, city: str):
+        subs = [sub for sub in self.subscriptions if sub["channel_id"] == ctx.channel.id]
+        # 先照 !weather_subs 列出來的名字找，找不到才查座標比對 (使用者打的不一定是正式名稱)
+        match = next((sub for sub in subs if sub["name"] == city), None)
+        if match is None:
+            lat, lon, _ = await self.get_coords(city)
+            if lat:
+                match = next((sub for sub in subs if coord_key(sub["lat"], sub["lon"]) == coord_key(lat, lon)), None)
+        if match is None:
+            await ctx.send(f"❌ 這個頻道沒有訂閱「{city}」")
+            return
+        self.subscriptions.remove(match)
+        await self.save_subscriptions()
+        await ctx.send(f"🗑️ 已取消訂閱 **{match['name']}**")
+
+    @commands.command()
+    async def weather_subs(self, ctx):
+        names = [sub["name"] for sub in self.subscriptions if sub["channel_id"] == ctx.channel.id]
+        if not names:
+            await ctx.send("📭 這個頻道還沒有訂閱任何地點，用 `!weather_sub 城市` 加一個吧")
+            return
+        await ctx.send("📬 這個頻道訂閱的地點：" + "、".join(names))
+
+    # ===============================
+    #  功能 3: 每天定時自動預報
     # ===============================
     broadcast_time = datetime.time(hour=22, minute=0, second=0)
 
     @tasks.loop(time=broadcast_time)
     async def daily_forecast_task(self):
-        for loc in self.daily_locations:
+        # 1. 相同座標的訂閱合併，所有地點一次查完
+        coords = {}
+        for sub in self.subscriptions:
+            coords.setdefault(coord_key(sub["lat"], sub["lon"]), (sub["lat"], sub["lon"]))
+        keys = list(coords)
+        results = dict(zip(keys, await self.get_weather_batch([coords[key] for key in keys])))
+
+        # 2. 再分送到各個訂閱的頻道
+        for loc in self.subscriptions:
             target_id = loc.get("channel_id")
             channel = self.bot.get_channel(target_id)
             
@@ -129,8 +314,7 @@ class Weather(commands.Cog):
                 print(f"❌ 找不到頻道 ID: {target_id}")
                 continue
 
-            # 抓取天氣 (加 await)
-            data = await self.get_weather_data(loc["lat"], loc["lon"])
+            data = results.get(coord_key(loc["lat"], loc["lon"]))
             
             if data:
                 embed = discord.Embed(
@@ -144,15 +328,16 @@ class Weather(commands.Cog):
                 if data['rain'] > 50:
                     embed.set_footer(text="☔ 記得帶傘！")
                 
-                await channel.send(embed=embed)
+                try:
+                    await channel.send(embed=embed)
+                except discord.HTTPException as e:
+                    # 訂閱是大家自己加的，某個頻道沒權限不能害其他頻道收不到 (例外跑出去 tasks.loop 會停掉)
+                    print(f"❌ {loc['name']} 天氣發送到頻道 {target_id} 失敗: {e}")
+                    continue
                 print(f"✅ 已發送 {loc['name']} 天氣")
             else:
                 print(f"❌ {loc['name']} 天氣資料抓取失敗")
 
-            # 👇【關鍵修改】每報完一個城市，休息 3 秒
-            # 這能防止 API 因為連續請求而拒絕連線
-            await asyncio.sleep(3)
-
     @daily_forecast_task.before_loop
     async def before_forecast(self):
         await self.bot.wait_until_ready()
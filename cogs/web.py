@@ -11,6 +11,7 @@ class WebServer(commands.Cog):
         self.runner = None
         self.site = None
         self.is_running = False # 防止重複啟動的開關
+        self.options_paths = set() # 已經掛過 OPTIONS 的路徑
         
         # 設定 CORS (解決跨域問題)
         self.app.on_response_prepare.append(self.cors_handler)
@@ -27,7 +28,10 @@ class WebServer(commands.Cog):
             self.app.router.add_post(path, handler)
         elif method == 'GET':
             self.app.router.add_get(path, handler)
-        self.app.router.add_options(path, lambda r: web.Response(status=200))
+        # 同一個路徑掛 GET + POST 時，OPTIONS 只能註冊一次，不然 aiohttp 會報重複路由
+        if path not in self.options_paths:
+            self.app.router.add_options(path, lambda r: web.Response(status=200))
+            self.options_paths.add(path)
 
     # ❌ 刪除了 cog_load 裡的啟動邏輯，避免太早鎖門
 
@@ -0,0 +1,16 @@
+# 檔案：replay_ledger.py
+# 離線重建工具：機器人停機時執行，從 economy.db 的最新快照 + 流水帳重建 users 表
+import asyncio
+from cogs.gambling import Ledger
+
+async def main():
+    ledger = Ledger("economy.db")
+    await ledger.open()
+    try:
+        count = await ledger.replay()
+        print(f"✅ 已從流水帳重建 {count} 位使用者的餘額")
+    finally:
+        await ledger.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())